@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import time, asyncio, concurrent.futures
+
+import urlhttp, urlutils, urlcrawler
+
+from color import Color
+
+
+class URLAsyncCrawler (urlcrawler.URLCrawler):
+
+    """
+        Crawls the urls of an URLDeque keeping many requests in flight at once
+        Requests run on a thread pool driven by an asyncio loop, responses are processed on the loop thread
+    """
+
+    def __init__ (self, *args, concurrency = 16, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.__concurrency = max(1, concurrency)
+
+        self.__inflight = {}
+        self.__unreachable = set()
+
+        # address -> connections failed in a row, the host is unreachable after connect_attempts
+        self.__failures = {}
+
+        self.__executor = None
+
+        # address -> URLHttp of the host, to ask for its robots.txt and crawl delay
+        self.__hosts = {}
+
+    def ___fetch (self, url, request_headers):
+
+        """ Runs on a worker thread, returns ( allowed, conn, rep, response_data, exc ) with the body still unread on conn """
+
+        if not self.allowed(self.robots(url), url):
+            return False, None, None, None, None
+
+        conn = self.pool.acquire(url)
+
+        if conn is None:
+            return True, None, None, None, urlutils.URLException('Could not connect to http server')
+
+        try:
+            rep, response_data = self.request(conn, url, request_headers)
+        except urlutils.URLException as exc:
+            self.pool.discard(conn)
+            return True, conn, None, None, exc
+
+        return True, conn, rep, response_data, None
+
+    def ___host (self, address):
+
+        url = self.__hosts.get(address)
+
+        if url is None:
+            url = self.__hosts[address] = urlhttp.URLHttp(address)
+
+        return url
+
+    def ___ready (self, address, now):
+
+        """ A request to the host of address may start, within its connection slots and its crawl delay """
+
+        # the items of an unreachable host only wait to be reported
+        if address in self.__unreachable:
+            return True
+
+        url = self.___host(address)
+        limit = 1 if self.crawl_delay(url) > 0 else self.pool.max_per_host
+
+        return self.__inflight.get(address, 0) < limit and self.ready_at(url) <= now
+
+    def ___next (self):
+
+        """ Next queued item of the hosts taking turns whose host may be requested now, None if no host is ready """
+
+        now = time.monotonic()
+        return self.urls.pop_ready(lambda address: self.___ready(address, now))
+
+    def ___wakeup (self):
+
+        """ Seconds until an idle host waiting on its crawl delay may be requested, None if no host waits on a delay """
+
+        now = time.monotonic()
+
+        times = [ self.ready_at(self.___host(address)) for address in self.urls.hosts() if self.__inflight.get(address, 0) == 0 ]
+        times = [ ready for ready in times if ready > now ]
+
+        if not times:
+            return None
+
+        return min(times) - now
+
+    async def ___stream (self, executor, url, cookies, charset, conn, rep, response_data):
+
+        """ Processes a response on the loop thread while its body is read on the thread pool """
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            response = self.response(url, cookies, charset, rep)
+
+            if response_data is not None:
+                if response.wants:
+                    response.feed(response_data)
+
+            elif response.wants:
+                while True:
+                    chunk = await loop.run_in_executor(executor, urlutils.read_chunk, rep)
+
+                    if not chunk:
+                        break
+
+                    response.feed(chunk)
+
+            else:
+                await loop.run_in_executor(executor, urlutils.discard_body, conn, rep, self.drain_limit)
+
+        except urlutils.URLException:
+            rep.close()
+            self.pool.discard(conn)
+            raise
+
+        self.pool.release(conn, reuse = not rep.will_close)
+
+        response.close()
+
+    async def ___handle (self, executor, url, ref, cookies, charset):
+
+        loop = asyncio.get_running_loop()
+        address = url.address_encoded
+
+        allowed, conn, rep, response_data, exc = await loop.run_in_executor(executor, self.___fetch, url, self.request_headers(url, ref, cookies))
+
+        # the crawl delay of a host is known once its robots.txt has been fetched
+        if allowed and self.ready_at(url) == 0.0:
+            self.throttle(url)
+
+        try:
+            if not allowed:
+                print(Color.YELLOW % 'Robot not allowed at {0}'.format(url.full))
+
+            elif exc is not None and conn is None:
+                failures = self.__failures[address] = self.__failures.get(address, 0) + 1
+
+                if failures < URLAsyncCrawler.connect_attempts:
+                    # tried again later, the url is not done with
+                    self.urls.requeue(url, ref, cookies, charset)
+                    return
+
+                self.__unreachable.add(address)
+                self.error(url, exc.value)
+
+            elif exc is not None:
+                self.error(url, exc.value)
+
+            else:
+                self.__failures.pop(address, None)
+
+                try:
+                    await self.___stream(executor, url, cookies, charset, conn, rep, response_data)
+                except urlutils.URLException as exc:
+                    self.error(url, exc.value)
+
+        finally:
+            self.__inflight[address] -= 1
+
+        self.completed(url)
+
+    async def ___crawl (self, executor):
+
+        pending = set()
+
+        while True:
+
+            self.prefetch_robots()
+
+            while len(pending) < self.__concurrency:
+
+                item = self.___next()
+
+                if item is None:
+                    break
+
+                url, ref, cookies, charset = item
+
+                if url.address_encoded in self.__unreachable:
+                    self.error(url, 'Could not connect to http server')
+                    self.completed(url)
+                    continue
+
+                self.__inflight[url.address_encoded] = self.__inflight.get(url.address_encoded, 0) + 1
+                self.throttle(url)
+
+                pending.add(asyncio.ensure_future(self.___handle(executor, *item)))
+
+            wakeup = self.___wakeup()
+
+            if not pending:
+                if self.urls.empty:
+                    break
+
+                await asyncio.sleep(wakeup or 0.0)
+                continue
+
+            done, pending = await asyncio.wait(pending, timeout = wakeup, return_when = asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                task.result()
+
+    def run (self):
+
+        if self.__executor is None:
+            self.__executor = concurrent.futures.ThreadPoolExecutor(self.__concurrency)
+
+        asyncio.run(self.___crawl(self.__executor))
+
+    def close (self):
+
+        if self.__executor is not None:
+            self.__executor.shutdown(wait = False, cancel_futures = True)
+            self.__executor = None
+
+        super().close()
+
+URLAsyncCrawler.connect_attempts = 3
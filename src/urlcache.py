@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os, pickle, sqlite3
+
+import urlhttp
+
+
+class URLCache (object):
+
+    """
+        On-disk cache of the validators (ETag, Last-Modified) and of the links found on each crawled url
+        A 304 Not Modified answer lets the crawler reuse the cached links without downloading or parsing the page
+    """
+
+    def __init__ (self, fname, commit_every = 100):
+
+        directory = os.path.dirname(fname)
+
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+        self.__db = sqlite3.connect(fname, timeout = 30.0)
+        self.__db.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, etag TEXT, modified TEXT, data BLOB)')
+
+        self.__commit_every = commit_every
+        self.__uncommitted = 0
+
+    def get (self, url):
+
+        """ Returns ( etag, modified, entry ) cached for url or None """
+
+        row = self.__db.execute('SELECT etag, modified, data FROM responses WHERE url = ?', ( url.encoded, )).fetchone()
+
+        if row is None:
+            return None
+
+        etag, modified, data = row
+        return etag, modified, pickle.loads(data)
+
+    def conditional_headers (self, url):
+
+        cached = self.get(url)
+        headers = {}
+
+        if cached is not None:
+            etag, modified, _ = cached
+
+            if etag:
+                headers['If-None-Match'] = etag
+
+            if modified:
+                headers['If-Modified-Since'] = modified
+
+        return headers
+
+    def links (self, url):
+
+        """ Returns ( status, reason, charset, links, redirect ) cached for url, links are ( URLHttp, front ) pairs """
+
+        cached = self.get(url)
+
+        if cached is None:
+            return None
+
+        entry = cached[2]
+
+        links = [ ( urlhttp.URLHttp(link), front ) for link, front in entry['links'] ]
+        redirect = urlhttp.URLHttp(entry['redirect']) if entry['redirect'] else None
+
+        return entry['status'], entry['reason'], entry['charset'], links, redirect
+
+    def store (self, url, etag, modified, status, reason, charset, links, redirect):
+
+        data = pickle.dumps({
+            'status': status,
+            'reason': reason,
+            'charset': charset,
+            'links': [ ( link.encoded, front ) for link, front in links ],
+            'redirect': redirect.encoded if redirect is not None else None
+        }, pickle.HIGHEST_PROTOCOL)
+
+        self.__db.execute('INSERT OR REPLACE INTO responses (url, etag, modified, data) VALUES (?, ?, ?, ?)', ( url.encoded, etag, modified, data ))
+
+        self.__uncommitted += 1
+
+        if self.__uncommitted >= self.__commit_every:
+            self.commit()
+
+    def commit (self):
+        self.__db.commit()
+        self.__uncommitted = 0
+
+    def close (self):
+        self.commit()
+        self.__db.close()
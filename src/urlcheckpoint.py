@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import os, time, pickle
+
+import urldeque
+
+
+class URLCheckpoint (object):
+
+    """
+        Append-only log of the crawled urls and of what crawling them queued
+        Replaying it over the starting urls rebuilds the URLDeque, cookies, errors and warnings of an interrupted crawl
+    """
+
+    def __init__ (self, directory, interval = 30.0):
+
+        os.makedirs(directory, exist_ok = True)
+
+        self.__fname = os.path.join(directory, 'checkpoint.log')
+        self.__interval = interval
+
+        self.__pending = []
+        self.__last = time.monotonic()
+
+    def record (self, url, operations, errors, warnings):
+
+        self.__pending.append(( url, operations, list(errors), list(warnings) ))
+
+        if time.monotonic() - self.__last >= self.__interval:
+            self.flush()
+
+    def flush (self):
+
+        if self.__pending:
+            with open(self.__fname, 'ab') as log:
+                pickle.dump(self.__pending, log, pickle.HIGHEST_PROTOCOL)
+                log.flush()
+                os.fsync(log.fileno())
+
+            self.__pending = []
+
+        self.__last = time.monotonic()
+
+    def replay (self):
+
+        """ Yields the logged records, dropping a batch left incomplete by a crash """
+
+        if not os.path.exists(self.__fname):
+            return
+
+        with open(self.__fname, 'r+b') as log:
+            good = 0
+
+            while True:
+                try:
+                    batch = pickle.load(log)
+                except ( EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError ):
+                    break
+
+                good = log.tell()
+
+                for record in batch:
+                    yield record
+
+            log.truncate(good)
+
+    def restore (self, urls, errors, warnings):
+
+        """ Replays the log over urls, removes the already crawled ones from it and returns how many they are """
+
+        done = set()
+
+        for url, operations, url_errors, url_warnings in self.replay():
+
+            done.add(url)
+
+            for operation, item, front in operations:
+                if operation == 'redirect':
+                    try:
+                        urls.push_redirect(*item, front = front)
+                    except urldeque.InfiniteRedirection:
+                        pass
+                else:
+                    urls.push(*item, front = front)
+
+            if url_errors:
+                errors[url] = url_errors
+
+            if url_warnings:
+                warnings[url] = url_warnings
+
+        urls.retain(lambda url: url not in done)
+
+        return len(done)
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import time, http.cookiejar, urllib.parse, os, re, email.message, copy
+import time, heapq, weakref, http.cookiejar, urllib.parse, os, re, email.message, copy
 import itertools as it
 
 
@@ -166,6 +166,12 @@ Cookie.time_formats = [
 
 class CookieJar (object):
 
+    """
+        Cookies indexed by domain and path, selecting the cookies of an url walks the suffixes of its hostname and
+        the prefixes of its path instead of testing every cookie, expired cookies are dropped from a heap
+        Copies share the index and copy only the domains they change, interned jars are immutable and shared by equal states
+    """
+
     @classmethod
     def client_header (_, cookies):
         data = '; '.join(map(str, cookies))
@@ -175,16 +181,119 @@ class CookieJar (object):
     def server_header (_, cookies):
         return '\r\n'.join(('Set-Cookie: ' + repr(x)) for x in cookies)
 
+    @staticmethod
+    def domains (domain):
+
+        """ Cookie domains matching a hostname, itself and every suffix following a dot """
+
+        yield domain
+
+        index = domain.find('.')
+
+        while index != -1:
+            yield domain[ index + 1 : ]
+            index = domain.find('.', index + 1)
+
+    @staticmethod
+    def paths (path):
+
+        """ Cookie paths matching a path, longest first """
+
+        result = [ path ]
+        index = path.rfind('/')
+
+        while index != -1:
+            result.append(path[ : index + 1 ])
+
+            if index > 0:
+                result.append(path[ : index ])
+
+            index = path.rfind('/', 0, index)
+
+        return dict.fromkeys(result)
+
+    @classmethod
+    def match_many (_, jars, scheme, domain, path, **kwargs):
+
+        """ Cookies of jars matching, a cookie of a jar hides the same one of the following jars """
+
+        seen = set()
+
+        for jar in jars:
+            for cookie in jar.match(scheme, domain, path, **kwargs):
+                if cookie not in seen:
+                    seen.add(cookie)
+                    yield cookie
+
     def __init__ (self, url = None, *args, **kwargs):
 
-        self.__cookies = kwargs.pop('_initial_cookies', set())
+        self.__index = {}
+        self.__expiry = []
+        self.__pushed = 0
+        self.__size = 0
+
+        self.__shared = False
+        self.__owned = set()
+        self.__interned = False
+
+        for cookie in kwargs.pop('_initial_cookies', ()):
+            self.add_cookie(cookie)
 
         if url is not None and ( len(args) or len(kwargs) ):
             self.set(url, *args, **kwargs)
 
+    def ___own (self, domain):
+
+        """ Copies what is shared with other jars before domain is changed """
+
+        if self.__interned:
+            raise ValueError('Interned cookie jars can not be changed, change a copy')
+
+        if self.__shared:
+            self.__index = dict(self.__index)
+            self.__expiry = list(self.__expiry)
+            self.__shared = False
+
+        if domain not in self.__owned:
+            paths = self.__index.get(domain)
+
+            if paths is not None:
+                self.__index[domain] = { path: dict(cookies) for path, cookies in paths.items() }
+
+            self.__owned.add(domain)
+
+    def ___find (self, cookie):
+        return self.__index.get(cookie.domain, {}).get(cookie.path, {}).get(cookie)
+
+    def ___remove (self, cookie):
+
+        self.___own(cookie.domain)
+
+        paths = self.__index[cookie.domain]
+        cookies = paths[cookie.path]
+
+        del cookies[cookie]
+        self.__size -= 1
+
+        if not cookies:
+            del paths[cookie.path]
+
+            if not paths:
+                del self.__index[cookie.domain]
+
     def add_cookie (self, cookie):
-        self.__cookies.discard(cookie)
-        self.__cookies.add(cookie)
+
+        if self.___find(cookie) is not None:
+            self.___remove(cookie)
+
+        self.___own(cookie.domain)
+
+        self.__index.setdefault(cookie.domain, {}).setdefault(cookie.path, {})[cookie] = cookie
+        self.__size += 1
+
+        if not cookie.session:
+            self.__pushed += 1
+            heapq.heappush(self.__expiry, ( cookie.expires, self.__pushed, cookie ))
 
     def set (self, url, *args, **kwargs):
 
@@ -224,47 +333,116 @@ class CookieJar (object):
                 self.add_cookie(Cookie(cookie.name, cookie.value, cookie.domain, cookie.path, cookie.expires))
 
     def clear_expired (self):
-        self.__cookies = set(filter(bool, self.__cookies))
+
+        """ Drops the expired cookies, interned jars keep them as matching skips them anyway """
+
+        now = time.time()
+
+        if self.__interned or not self.__expiry or self.__expiry[0][0] >= now:
+            return
+
+        if self.__shared:
+            self.__expiry = list(self.__expiry)
+
+        expiry = self.__expiry
+
+        while expiry and expiry[0][0] < now:
+            cookie = heapq.heappop(expiry)[2]
+
+            if self.___find(cookie) is cookie:
+                self.___remove(cookie)
 
     def clear_session (self):
-        self.__cookies = set(c for c in self.__cookies if not c.session)
+        for cookie in [ cookie for cookie in self if cookie.session ]:
+            self.___remove(cookie)
+
+    def match (self, scheme, domain, path, test_expired = True, test_secure = True):
+
+        hostname = Cookie.match_domain_hostname.fullmatch(domain)
+
+        if hostname is None or hostname.group(1) is None:
+            return
+
+        now = time.time()
+        paths = None
+
+        for cookie_domain in CookieJar.domains(domain):
+
+            by_path = self.__index.get(cookie_domain)
+
+            if by_path is None:
+                continue
+
+            if paths is None:
+                paths = CookieJar.paths(path)
 
-    def match (self, scheme, domain, path, **kwargs):
-        for cookie in self.__cookies:
-            if cookie.match(scheme, domain, path, **kwargs):
-                yield cookie
+            for cookie_path in paths:
+                for cookie in by_path.get(cookie_path, ()):
+                    if not test_expired or cookie.session or now <= cookie.expires:
+                        if not test_secure or scheme == 'https' or not cookie.secure:
+                            yield cookie
 
     def match_url (self, url, **kwargs):
         url_data = urllib.parse.urlsplit(url)
         return self.match(url_data.scheme, url_data.domain, url_data.path, **kwargs)
 
     def copy (self):
-        return copy.deepcopy(self)
+
+        """ Changeable copy sharing the cookies of this jar until one of them changes """
+
+        result = CookieJar()
+
+        result.__index = self.__index
+        result.__expiry = self.__expiry
+        result.__pushed = self.__pushed
+        result.__size = self.__size
+        result.__shared = True
+
+        if not self.__interned:
+            self.__shared = True
+            self.__owned = set()
+
+        return result
+
+    def intern (self):
+
+        """ Returns the immutable jar shared by every interned jar holding the same cookies """
+
+        key = frozenset(
+            ( cookie.domain, cookie.path, cookie.name, cookie.value, cookie.expires, cookie.secure, cookie.httponly ) for cookie in self
+        )
+
+        result = CookieJar.interned.get(key)
+
+        if result is None:
+            result = self.copy()
+            result.__interned = True
+            CookieJar.interned[key] = result
+
+        return result
 
     @property
     def cookies (self):
-        return self.__cookies.copy()
+        return set(self)
 
     def __or__ (self, other):
-        cookies = set()
-
-        for cookie in it.chain(self.__cookies, other.__cookies):
-            if cookie not in cookies:
-                cookies.add(cookie)
-
-        return CookieJar(_initial_cookies = cookies)
+        return CookieJar(_initial_cookies = it.chain(other, self))
 
     def __len__ (self):
-        return len(self.__cookies)
+        return self.__size
 
     def __bool__ (self):
         return len(self) > 0
 
     def __str__ (self):
-        return CookieJar.client_header(self.__cookies)
+        return CookieJar.client_header(self)
 
     def __repr__ (self):
-        return CookieJar.server_header(self.__cookies)
+        return CookieJar.server_header(self)
 
     def __iter__ (self):
-        return iter(self.__cookies)
+        for paths in self.__index.values():
+            for cookies in paths.values():
+                yield from cookies
+
+CookieJar.interned = weakref.WeakValueDictionary()
@@ -0,0 +1,650 @@
+# -*- coding: utf-8 -*-
+import time, gzip, zlib, codecs, mimetypes
+import itertools as it
+
+import urlutils, urlhttp, urldeque, urlfinder, urlcookie, urlpool, urlcache, urlrobots
+
+from color import Color
+
+
+class URLCrawler (object):
+
+    """ Crawls the urls of an URLDeque, one domain and one connection at a time """
+
+    @staticmethod
+    def is_asset (url):
+
+        """ Urls whose extension is of a type the crawler never reads (images, media, archives, ...) """
+
+        mime = mimetypes.guess_type(url.path)[0]
+        return mime is not None and urlutils.content_kind({ mime: '' }) is None
+
+    def __init__ (self, args, urls, fixed_cookies, html_queue = None, css_queue = None, js_queue = None, pool = None, checkpoint = None, cache = None):
+
+        self.__args = args
+        self.__urls = urls
+        self.__fixed_cookies = fixed_cookies
+
+        self.__pool = pool or urlpool.URLConnectionPool(args.timeout, args.max_connections, args.idle_timeout)
+
+        self.__robots = None
+        self.__next_request = {}
+
+        if not args.no_robots:
+            self.__robots = urlrobots.URLRobots(args.user_agent, self.__pool, args.robots_ttl, args.robots_cache)
+
+        self.__html_queue = html_queue
+        self.__css_queue = css_queue
+        self.__js_queue = js_queue
+
+        self.__errors = {}
+        self.__warnings = {}
+
+        self.__checkpoint = checkpoint
+
+        # page -> links and redirects it queued, kept apart for pages crawled at the same time
+        self.__operations = {}
+
+        self.__cache = cache
+
+        if cache is None and args.cache:
+            self.__cache = urlcache.URLCache(args.cache)
+
+    def error (self, url, message):
+        self.__errors.setdefault(url, []).append(message)
+
+    def warning (self, url, message):
+        self.__warnings.setdefault(url, []).append(message)
+
+    def push (self, url, page, cookies, charset, front = False):
+        if self.__checkpoint is not None:
+            self.__operations.setdefault(page, []).append(( 'push', ( url, page, cookies, charset ), front ))
+        return self.__urls.push(url, page, cookies, charset, front = front)
+
+    def push_redirect (self, url, page, cookies, charset, front = False):
+        result = self.__urls.push_redirect(url, page, cookies, charset, front = front)
+        if self.__checkpoint is not None:
+            self.__operations.setdefault(page, []).append(( 'redirect', ( url, page, cookies, charset ), front ))
+        return result
+
+    def completed (self, url):
+
+        """ Called once a popped url is done with, logs it and what it queued when checkpointing """
+
+        if self.__checkpoint is not None:
+            self.__checkpoint.record(url, self.__operations.pop(url, []), self.__errors.get(url, ()), self.__warnings.get(url, ()))
+
+    def references (self, url):
+        return self.__urls.references(url)
+
+    def robots (self, url):
+
+        """ Robots policy of the host of url, None if not available, safe to call from many threads """
+
+        if self.__robots is None:
+            return None
+
+        return self.__robots.get(url)
+
+    def allowed (self, robots, url):
+        return robots is None or robots.allowed(url)
+
+    def prefetch_robots (self, count = 8):
+
+        """ Fetches in background the robots.txt of the next hosts to crawl """
+
+        if self.__robots is not None:
+            self.__robots.prefetch(list(it.islice(self.__urls.domains(), count)))
+
+    def crawl_delay (self, url):
+
+        """ Seconds to wait between requests to the host of url, as asked by its robots.txt and known so far """
+
+        if self.__robots is None:
+            return 0.0
+
+        robots = self.__robots.cached(url)
+
+        if robots is None:
+            return 0.0
+
+        return min(robots.crawl_delay, self.__args.max_crawl_delay)
+
+    def ready_at (self, url):
+
+        """ Monotonic time from which a request to the host of url respects its crawl delay """
+
+        return self.__next_request.get(url.address_encoded, 0.0)
+
+    def throttle (self, url):
+
+        """ Records a request to the host of url being sent now """
+
+        if self.__robots is None:
+            return
+
+        # looked up once, a policy due for a fetch again is not cached anymore
+        robots = self.__robots.cached(url)
+
+        if robots is None or not self.allowed(robots, url):
+            return
+
+        delay = min(robots.crawl_delay, self.__args.max_crawl_delay)
+
+        if delay > 0:
+            self.__next_request[url.address_encoded] = time.monotonic() + delay
+
+    def close_robots (self):
+        if self.__robots is not None:
+            self.__robots.close()
+
+    def request_headers (self, url, ref, cookies):
+
+        cookies.clear_expired()
+        self.__fixed_cookies.clear_expired()
+
+        request_headers = self.__args.headers.copy()
+
+        if self.__fixed_cookies or cookies:
+            url_cookies = urlcookie.CookieJar.match_many(( self.__fixed_cookies, cookies ), url.scheme, url.hostname_encoded, url.path_encoded)
+            cookie_txt = '; '.join(map(str, url_cookies))
+            if request_headers.get('Cookie', ''):
+                cookie_txt = request_headers['Cookie'] + '; ' + cookie_txt
+            request_headers['Cookie'] = cookie_txt
+
+        if ref != url and not 'Referer' in request_headers:
+            request_headers['Referer'] = ref.encoded
+
+        if self.__cache is not None:
+            request_headers.update(self.__cache.conditional_headers(url))
+
+        return request_headers
+
+    def ___probe (self, conn, url, request_headers):
+
+        """ Checks an asset with HEAD or a one byte range request, returns ( None, None ) when a full GET is needed """
+
+        if self.__args.probe_assets == 'head':
+            rep, response_data = urlutils.make_request(conn, 'HEAD', url.request_encoded, headers = request_headers, read_body = False)
+        else:
+            headers = request_headers.copy()
+            headers['Range'] = 'bytes=0-0'
+            rep, response_data = urlutils.make_request(conn, 'GET', url.request_encoded, headers = headers, read_body = False)
+
+        if rep is None or rep.status >= 400 or self.wants_body(url, rep):
+            return None, None
+
+        return rep, response_data
+
+    def request (self, conn, url, request_headers):
+
+        """ Returns ( rep, response_data ), response_data is None while the body is still unread on conn """
+
+        if self.__args.probe_assets and URLCrawler.is_asset(url):
+            rep, response_data = self.___probe(conn, url, request_headers)
+
+            if rep is not None:
+                return rep, response_data
+
+        rep, response_data = urlutils.make_request(conn, 'GET', url.request_encoded, headers = request_headers, read_body = None)
+
+        if rep is None or ( rep.status >= 400 and url.request != url.request_encoded ):
+
+            if rep is not None:
+                response_data = b''.join(urlutils.read_chunks(rep))
+
+            new_rep, new_response_data = urlutils.make_request(conn, 'GET', url.request, headers = request_headers, read_body = None)
+
+            if new_rep is not None and new_rep.status < 400:
+                rep = new_rep
+                response_data = new_response_data
+            elif new_rep is not None:
+                urlutils.discard_body(conn, new_rep, self.drain_limit)
+
+        if rep is None:
+            raise urlutils.URLException('Could not fetch data from server: {0}'.format(response_data))
+
+        return rep, response_data
+
+    def included (self, url):
+        return self.__args.include_rules.search(url.full) and not self.__args.exclude_rules.search(url.full)
+
+    def wanted (self, kind):
+        args = self.__args
+        return kind == 'html' or ( kind == 'css' and ( not args.no_css or args.valid_css ) ) or ( kind == 'js' and args.valid_js )
+
+    def wants_body (self, url, rep):
+
+        """ Decides from the response headers if the body will be read """
+
+        if not self.__args.no_redirect and rep.getheader('location') is not None:
+            return False
+
+        if not self.included(url):
+            return False
+
+        return self.wanted(urlutils.content_kind(urlutils.content_split(rep.getheader('content-type', URLCrawler.default_content_type))))
+
+    def validate (self, kind, url, data = None, content_type = None):
+
+        if kind == 'html':
+            self.__html_queue.put(( url, gzip.compress(data), {
+                'Content-Type': content_type,
+                'Content-Encoding': 'gzip'
+            } ))
+
+        elif kind == 'css':
+            self.__css_queue.put(url)
+
+        elif kind == 'js':
+            self.__js_queue.put(( url, data ))
+
+    def response (self, url, cookies, charset, rep):
+        return URLResponse(self, url, cookies, charset, rep)
+
+    def process (self, url, cookies, charset, rep, response_data = None, conn = None):
+
+        """ Processes a response, streaming its body from rep on conn when response_data is None """
+
+        response = self.response(url, cookies, charset, rep)
+
+        try:
+            if response_data is not None:
+                if response.wants:
+                    response.feed(response_data)
+
+            elif response.wants:
+                for chunk in urlutils.read_chunks(rep):
+                    response.feed(chunk)
+
+            else:
+                urlutils.discard_body(conn, rep, self.drain_limit)
+
+        except urlutils.URLException:
+            rep.close()
+
+            if conn is not None:
+                conn.close()
+
+            raise
+
+        response.close()
+
+    def run (self):
+
+        """ Crawls the queued urls until none is left, connections and robots.txt stay open to crawl more later """
+
+        urls = self.__urls
+
+        while not urls.empty:
+
+            url = urlhttp.URLHttp(urls.pop_domain())
+            robots = self.robots(url)
+
+            self.prefetch_robots()
+
+            conn = self.__pool.acquire(url)
+
+            if conn is None:
+                while not urls.empty_domain:
+                    url, *ignore = urls.pop_url()
+                    self.error(url, 'Could not connect to http server')
+                    self.completed(url)
+                continue
+
+            try:
+                while not urls.empty_domain:
+
+                    try:
+                        url, ref, cookies, charset = urls.pop_url()
+
+                        if not self.allowed(robots, url):
+                            print(Color.YELLOW % 'Robot not allowed at {0}'.format(url.full))
+
+                        else:
+                            time.sleep(max(0.0, self.ready_at(url) - time.monotonic()))
+                            self.throttle(url)
+
+                            rep, response_data = self.request(conn, url, self.request_headers(url, ref, cookies))
+                            self.process(url, cookies, charset, rep, response_data, conn)
+
+                    except urlutils.URLException as exc:
+                        self.error(url, exc.value)
+
+                    self.completed(url)
+
+            finally:
+                self.__pool.release(conn)
+
+    def close (self):
+
+        """ Closes the connections and robots.txt cache and saves the checkpoint and cache of the crawl """
+
+        self.close_robots()
+        self.__pool.close()
+
+        if self.__checkpoint is not None:
+            self.__checkpoint.flush()
+
+        if self.__cache is not None:
+            self.__cache.commit()
+
+    def crawl (self):
+        try:
+            self.run()
+        finally:
+            self.close()
+
+    @property
+    def args (self):
+        return self.__args
+
+    @property
+    def urls (self):
+        return self.__urls
+
+    @property
+    def pool (self):
+        return self.__pool
+
+    @property
+    def checkpoint (self):
+        return self.__checkpoint
+
+    @property
+    def cache (self):
+        return self.__cache
+
+    @property
+    def drain_limit (self):
+        return 65536 if self.__args.header_first else None
+
+    @property
+    def errors (self):
+        return self.__errors
+
+    @property
+    def warnings (self):
+        return self.__warnings
+
+URLCrawler.default_content_type = 'application/octet-stream; charset=iso-8859-1'
+
+class URLResponse (object):
+
+    """
+        Consumes the body of a response chunk by chunk, decompressing, decoding and parsing it incrementally
+        Links are queued as soon as they are parsed, body size and decompression ratio are bounded
+    """
+
+    def __init__ (self, crawler, url, cookies, charset, rep):
+
+        args = crawler.args
+
+        self.__crawler = crawler
+        self.__url = url
+        self.__rep = rep
+        self.__charset = charset
+        self.__headers = headers = urlutils.parse_headers(rep.getheaders())
+
+        self.__links = []
+        self.__redirect = None
+        self.__cached = False
+
+        self.__kind = None
+        self.__decompressor = None
+        self.__decoder = None
+        self.__html = None
+        self.__found = 0
+        self.__switched = False
+        self.__content_type = None
+        self.__head = None
+        self.__head_size = 0
+        self.__raw = None
+        self.__text = None
+
+        self.__size_in = 0
+        self.__size_out = 0
+
+        if not args.no_cookies and 'set-cookie' in headers:
+            cookies = cookies.copy()
+            cookies.set(url.encoded, *headers['set-cookie'])
+            cookies = cookies.intern()
+
+        self.__cookies = cookies
+
+        cached = None
+
+        if rep.status == 304 and crawler.cache is not None:
+            cached = crawler.cache.links(url)
+
+        if cached is not None:
+            status, reason, self.__charset, links, self.__redirect = cached
+            self.__cached = True
+
+            print(Color.GREEN % '{0} {1} {2} (not modified)'.format(url, status, reason))
+
+            for link, front in links:
+                self.___push(link, front)
+
+        elif not args.no_redirect and 'location' in headers:
+            self.__redirect = url.hyperlink(headers['location'][0])
+
+        else:
+            print((Color.GREEN if rep.status < 300 else Color.YELLOW) % '{0} {1} {2}'.format(url, rep.status, rep.reason))
+
+            if rep.status >= 300:
+                if rep.status >= 400:
+                    crawler.warning(url, '{0} {1}'.format(rep.status, rep.reason))
+                else:
+                    crawler.warning(url, '{0} {1} (no redirect location given)'.format(rep.status, rep.reason))
+
+            if crawler.included(url):
+                content_type = urlutils.content_split(headers.get('content-type', [ URLCrawler.default_content_type ])[0])
+                kind = urlutils.content_kind(content_type)
+
+                if crawler.wanted(kind):
+                    self.___start(kind, content_type)
+
+    def ___start (self, kind, content_type):
+
+        args = self.__crawler.args
+
+        self.__kind = kind
+        self.__content_type = content_type
+
+        if 'content-encoding' in self.__headers:
+            self.__decompressor = urlutils.decompressor(self.__headers['content-encoding'][0])
+
+        if 'charset' in content_type:
+            self.___decode_with(content_type['charset'], 'ignore')
+        else:
+            self.___decode_with(self.__charset, 'strict')
+
+        if kind == 'html':
+            self.__html = urlfinder.URLFinderHTML('', self.__url, self.__charset)
+
+            if args.valid_html:
+                self.__raw = []
+
+        elif ( kind == 'css' and not args.no_css ) or ( kind == 'js' and args.valid_js ):
+            self.__text = []
+
+        if self.__html is not None or ( self.__text is not None and kind == 'css' ):
+            self.__head = []
+
+    def ___decode_with (self, charset, errors):
+
+        try:
+            self.__decoder = codecs.getincrementaldecoder(charset)(errors = errors)
+        except LookupError:
+            charset = 'iso-8859-1'
+            self.__decoder = codecs.getincrementaldecoder(charset)(errors = 'ignore')
+
+        self.__charset = charset
+
+    def ___decode (self, data, final = False):
+        try:
+            return self.__decoder.decode(data, final)
+        except ValueError:
+            # a meta found later must not switch back to the charset that failed
+            self.___decode_with('iso-8859-1', 'ignore')
+            self.__switched = True
+            return self.__decoder.decode(data, final)
+
+    def ___sniff (self, data, final):
+
+        """ Holds the first bytes of the body until its charset can be sniffed, returns them all at once, None while holding """
+
+        self.__head.append(data)
+        self.__head_size += len(data)
+
+        if self.__head_size < urlutils.sniff_charset.window and not final:
+            return None
+
+        data = b''.join(self.__head)
+        self.__head = None
+
+        charset = urlutils.sniff_charset(data, self.__content_type, self.__kind)
+
+        # a declared charset is kept even if a later meta disagrees, nothing is decoded twice
+        if charset is not None:
+            self.___decode_with(charset, 'ignore')
+            self.__switched = True
+
+        return data
+
+    def ___push (self, link, front):
+        self.__links.append(( link, front ))
+        self.__crawler.push(link, self.__url, self.__cookies, self.__charset, front = front)
+
+    def ___parsed (self):
+
+        args = self.__crawler.args
+        html = self.__html
+
+        # nofollow links are checked too, a dead link is broken whoever may follow it
+        for link, tag, attr, rel in it.islice(html.urls, self.__found, None):
+            # content urls of a meta are only found on refreshes
+            if not args.no_redirect and tag == 'meta' and attr == 'content':
+                self.__redirect = link
+            else:
+                self.___push(link, tag != 'a' or attr != 'href')
+
+        self.__found = len(html.urls)
+
+        if not self.__switched and html.meta_charset is not None and html.meta_charset != self.__charset.lower():
+            self.__switched = True
+            self.___decode_with(html.meta_charset, 'ignore')
+
+    def ___consume (self, data, final = False):
+
+        args = self.__crawler.args
+
+        self.__size_out += len(data)
+
+        if args.max_body_size and self.__size_out > args.max_body_size:
+            raise urlutils.URLException('Response body larger than {0} bytes'.format(args.max_body_size))
+
+        if args.max_ratio and self.__size_out > URLResponse.ratio_floor and self.__size_out > args.max_ratio * self.__size_in:
+            raise urlutils.URLException('Response decompression ratio above {0}'.format(args.max_ratio))
+
+        if self.__raw is not None:
+            self.__raw.append(data)
+
+        if self.__head is not None:
+            data = self.___sniff(data, final)
+
+            if data is None:
+                return
+
+        text = self.___decode(data, final)
+
+        if self.__html is not None:
+            self.__html.feed(text)
+            self.___parsed()
+
+        elif self.__text is not None:
+            self.__text.append(text)
+
+    def feed (self, chunk):
+
+        max_body_size = self.__crawler.args.max_body_size
+
+        self.__size_in += len(chunk)
+
+        if self.__decompressor is not None:
+            try:
+                chunk = self.__decompressor.decompress(chunk, max_body_size and max_body_size - self.__size_out + 1)
+            except zlib.error as exc:
+                raise urlutils.URLException('Could not decompress response: {0}'.format(exc))
+
+        self.___consume(chunk)
+
+    def close (self):
+
+        """ Finishes the body, sends it to validation, caches its links and queues its redirection """
+
+        crawler = self.__crawler
+        args = crawler.args
+        url = self.__url
+        kind = self.__kind
+
+        if kind is not None:
+            tail = b''
+
+            if self.__decompressor is not None:
+                try:
+                    tail = self.__decompressor.flush()
+                except zlib.error as exc:
+                    raise urlutils.URLException('Could not decompress response: {0}'.format(exc))
+
+            self.___consume(tail, True)
+
+            if kind == 'html':
+                self.__html.close()
+                self.___parsed()
+
+                if args.valid_html:
+                    crawler.validate('html', url, b''.join(self.__raw), self.__headers['content-type'][0])
+
+            elif kind == 'css':
+                if not args.no_css:
+                    css = urlfinder.URLFinderCSS(''.join(self.__text), url, self.__charset)
+                    self.__charset = css.charset
+
+                    for link in css:
+                        self.___push(link, True)
+
+                if args.valid_css:
+                    crawler.validate('css', url)
+
+            elif kind == 'js':
+                #TODO parse javascript
+                if args.valid_js:
+                    crawler.validate('js', url, ''.join(self.__text))
+
+        rep = self.__rep
+
+        if not self.__cached and crawler.cache is not None and rep.status == 200 and ( 'etag' in self.__headers or 'last-modified' in self.__headers ):
+            crawler.cache.store(
+                url, self.__headers.get('etag', [ None ])[0], self.__headers.get('last-modified', [ None ])[0],
+                rep.status, rep.reason, self.__charset, self.__links, self.__redirect
+            )
+
+        redirect = self.__redirect
+
+        if redirect is not None:
+            try:
+                crawler.push_redirect(redirect, url, self.__cookies, self.__charset, front = True)
+            except urldeque.InfiniteRedirection as infinite_redir:
+                print(Color.RED % 'Redirection loop detected!')
+                print(Color.RED % '{0} --> ... --> {1} --> ... --> {0}'.format(url, redirect, url))
+                raise urlutils.URLException(str(infinite_redir))
+            else:
+                print(Color.CYAN % '{0} --> {1}'.format(url, redirect))
+
+    @property
+    def wants (self):
+        return self.__kind is not None
+
+URLResponse.ratio_floor = 1 << 20
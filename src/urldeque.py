@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import copy, urlhttp
+import array, heapq, collections, urlhttp, urlpolicy
 
 
 class InfiniteRedirection (Exception):
@@ -20,178 +20,772 @@ class InfiniteRedirection (Exception):
     def urls (self):
         return self.__urls
 
+class URLTable (object):
+
+    """ Interns urls, every distinct url gets a dense integer id, ids of released urls are given again """
+
+    def __init__ (self):
+        self.__urls = []
+        self.__ids = {}
+        self.__free = []
+
+    def intern (self, url):
+
+        url_id = self.__ids.get(url)
+
+        if url_id is None:
+            if self.__free:
+                url_id = self.__free.pop()
+                self.__urls[url_id] = url
+            else:
+                url_id = len(self.__urls)
+                self.__urls.append(url)
+
+            self.__ids[url] = url_id
+
+        return url_id
+
+    def release (self, url_id):
+        del self.__ids[self.__urls[url_id]]
+        self.__urls[url_id] = None
+        self.__free.append(url_id)
+
+    def get (self, url):
+        return self.__ids.get(url)
+
+    def __getitem__ (self, url_id):
+        return self.__urls[url_id]
+
+    def __len__ (self):
+        return len(self.__urls)
+
+class URLHost (object):
+
+    """ Queue of the items of one host, a head in memory, then its chunks spilled to disk, then a tail of the items pushed after them """
+
+    __slots__ = ( 'head', 'tail' )
+
+    def __init__ (self, head):
+        self.head = head
+        self.tail = []
+
 class URLDeque (object):
 
-    """ Manage HTTPUrls and domains as a queue """
+    """
+        Manage HTTPUrls and domains as a queue
+        Urls are interned in an URLTable, queue items, redirects and references only hold their ids
+        Redirects form a forest resolved union-find style, each url keeps a path compressed pointer towards its final target
+        Referrers stay on the url they linked to, roads are the redirect paths from it to the target, walked when reported
+        References may be kept in an URLGraph instead of memory
+        With an URLGraph and an URLSeen deciding which urls are new, urls are only kept while queued or part of a redirect
+        Every host has its own URLHost queue, hosts with queued items take turns in a ring, switching host moves nothing
+        Items of any host can be popped, so many hosts can be crawled at once
+        With an URLSpill only window queued items are kept in memory, the queues of the hosts are moved to disk in chunks
+        With an URLPolicy the queues of the hosts are URLHeaps ordered by it, the host with the first url is crawled next
+    """
 
-    def ___force_push (self, url, page, *extra, front = False):
+    def ___intern (self, url):
 
-        item = ( url, page ) + extra
+        url_id = self.__table.intern(url)
 
-        if url.address_encoded == self.__address:
+        if url_id == len(self.__redirects):
+            self.__redirects.append(-1)
+            self.__targets.append(-1)
+            self.__referrers.append(None)
 
-            if front:
-                queued = [ item, self.__first ]
+            if self.__pins is not None:
+                self.__pins.append(0)
 
-                if self.empty_domain:
-                    self.__last = queued
+            if self.__policy is not None:
+                self.__depths.append(0)
+                self.__counts.append(0)
 
-                self.__first = queued
+        return url_id
 
-            else:
-                queued = [ item, None ]
+    def ___key (self, item, front):
+        return self.__policy.key(self.__depths[item[0]], self.__counts[item[0]], front)
 
-                if self.empty_domain:
-                    self.__first = queued
-                else:
-                    self.__last[1] = queued
+    def ___queue_of (self):
+        return urlpolicy.URLHeap(self.___key) if self.__policy is not None else collections.deque()
+
+    def ___rank (self, url_id, depth, references, insert):
+
+        """ Sets the depth of a new url and counts references more links to it, before it is queued """
+
+        if insert:
+            self.__depths[url_id] = depth
+
+        self.__counts[url_id] += references
+
+        if not insert and self.__policy.dynamic:
+            address = self.__table[url_id].address_encoded
+            host = self.__hosts.get(address)
+
+            if host is not None:
+                host.head.update(url_id)
+                self.___reorder(address)
+
+    def ___pin (self, url_id):
+        if self.__pins is not None:
+            self.__pins[url_id] += 1
+
+    def ___unpin (self, url_id):
+        if self.__pins is not None:
+            self.__pins[url_id] -= 1
+            self.___settle(url_id)
+
+    def ___settle (self, url_id):
+
+        """ Releases a url neither queued nor part of a redirect, only when the seen-set decides which urls are new """
+
+        if self.__pins is not None and self.__pins[url_id] == 0 and self.__table[url_id] is not None:
+            self.__table.release(url_id)
+            self.__referrers[url_id] = None
+
+    def ___new (self, url_id):
+        if self.__seen is not None:
+            return self.__seen.add(self.__table[url_id])
+        return self.__referrers[url_id] is None
+
+    def ___item (self, item):
+        table = self.__table
+        return ( table[item[0]], table[item[1]] ) + item[2 : ]
+
+    def ___find (self, url_id):
+
+        """ Final target of the redirects from url_id, compressing the path walked """
+
+        targets = self.__targets
+        root = url_id
+
+        while targets[root] != -1:
+            root = targets[root]
+
+        while targets[url_id] != -1:
+            targets[url_id], url_id = root, targets[url_id]
+
+        return root
+
+    def ___road (self, url_id, target_id):
+
+        """ Urls redirected through from url_id to target_id, target_id excluded """
+
+        road = []
+
+        while url_id != target_id:
+            road.append(self.__table[url_id])
+            url_id = self.__redirects[url_id]
+
+        return tuple(road)
+
+    def ___tree (self, url_id):
+
+        """ Yields ( id, road ) of url_id and of the urls redirected to it, road holds the ids from the url to url_id """
+
+        stack = [ ( url_id, () ) ]
+
+        while stack:
+            node, road = stack.pop()
+
+            yield node, road
+
+            for source in self.__sources.get(node, ()):
+                stack.append(( source, ( source, ) + road ))
+
+    def ___linked (self, url_id):
+
+        """ Pages linking to url_id itself """
+
+        if self.__graph is not None:
+            return self.__graph.references(self.__table[url_id])
+
+        return ( self.__table[page_id] for page_id in self.___pages(url_id) )
+
+    def ___refer (self, url_id, page_id):
 
-                self.__last = queued
+        """ Records that page_id links to url_id """
 
-            self.__size += 1
+        if self.__graph is not None:
+            self.__referrers[url_id] = True
+            self.__graph.link(self.__table[url_id], self.__table[page_id])
+            return
+
+        referrers = self.__referrers[url_id]
+
+        if referrers is None:
+            self.__referrers[url_id] = page_id
+
+        elif type(referrers) is int:
+            if referrers != page_id:
+                self.__referrers[url_id] = { referrers, page_id }
 
         else:
-            self.__external.setdefault(url.address_encoded, []).append(item)
+            referrers.add(page_id)
 
-    def __init__ (self):
+    def ___cycle (self, url_id, page_id):
+
+        """ Whether page_id redirecting to url_id closes a loop, page_id is a final target unless it redirected before """
+
+        if url_id == page_id:
+            return True
+
+        if self.__redirects[page_id] == -1:
+            return self.___find(url_id) == page_id
+
+        redir = url_id
+
+        while redir != -1:
+            if redir == page_id:
+                return True
+            redir = self.__redirects[redir]
+
+        return False
+
+    def ___force_push (self, url_id, page_id, extra, front = False):
+        self.___pin(url_id)
+        self.___pin(page_id)
+        self.___queue(( url_id, page_id ) + extra, front)
+
+    def ___host (self, address):
+
+        """ Queue of address, a new one joins the back of the ring """
+
+        host = self.__hosts.get(address)
+
+        if host is None:
+            host = self.__hosts[address] = URLHost(self.___queue_of())
+
+            # an address left in the ring by an emptied queue keeps its turn
+            if address not in self.__ringed:
+                self.__ringed.add(address)
+                self.__ring.append(address)
+
+        return host
+
+    def ___queue (self, item, front = False):
+
+        address = self.__table[item[0]].address_encoded
+        host = self.___host(address)
+
+        if front:
+            host.head.appendleft(item)
+        elif host.tail or self.___spilled(address):
+            host.tail.append(item)
+        else:
+            host.head.append(item)
+
+        self.__held += 1
+
+        if self.__policy is not None:
+            self.___reorder(address)
+
+        if self.__spill is not None and self.__held > self.__window:
+            self.___spill()
+
+    def ___spilled (self, address):
+        return self.__spill is not None and self.__spill.count(address) > 0
+
+    def ___dump (self, address, items, write):
+
+        """ Writes items to disk with write, an end of the spilled queue of address, and forgets them """
+
+        write(address, [ self.___item(item) for item in items ])
+
+        self.__held -= len(items)
+        self.___drop(items)
+
+    def ___spill (self):
+
+        """ Moves queued items to disk until half the window is left, from the longest queues to the current host """
+
+        target = self.__window // 2
+        order = lambda entry: ( entry[0] == self.__address, -len(entry[1].head) - len(entry[1].tail) )
+
+        for address, host in sorted(self.__hosts.items(), key = order):
+            if self.__held <= target:
+                break
+
+            if host.tail:
+                self.___dump(address, host.tail, self.__spill.append)
+                host.tail = []
+
+            if self.__held > target and host.head:
+                count = min(len(host.head), self.__held - target)
+                items = [ host.head.pop() for _ in range(count) ]
+                items.reverse()
+                self.___dump(address, items, self.__spill.prepend)
+
+    def ___load (self, address, host):
+
+        """ Refills the head of the queue of address from its first chunk on disk or from its tail """
+
+        items = self.__spill.take(address) if self.__spill is not None else []
+
+        if not items:
+            host.head.extend(host.tail)
+            host.tail = []
+            return
+
+        for url, page, *extra in items:
+            url_id = self.___intern(url)
+            page_id = self.___intern(page)
+
+            self.___pin(url_id)
+            self.___pin(page_id)
+
+            host.head.append(( url_id, page_id ) + tuple(extra))
+
+        self.__held += len(items)
+
+    def ___reorder (self, address):
+
+        """ Keeps the entry of address in the heap of hosts in step with the key of its first url, the old entry is left behind invalid """
+
+        host = self.__hosts.get(address)
+        top = host.head.top if host is not None else None
+
+        # [ top, address, valid ]
+        entry = self.__order_entries.pop(address, None)
+
+        if entry is not None:
+            if entry[0] == top:
+                self.__order_entries[address] = entry
+                return
+
+            entry[2] = False
+
+        if top is not None:
+            entry = self.__order_entries[address] = [ top, address, True ]
+            heapq.heappush(self.__order, entry)
+
+    def ___first (self, ready):
+
+        """ Address with the first url by the policy accepted by ready, hosts it does not accept are set aside meanwhile """
+
+        order = self.__order
+        skipped = []
+        address = None
 
-        self.__size = 0
+        while order:
+            entry = order[0]
 
-        self.__linked = {}
-        self.__redirects = {}
-        self.__external = {}
+            if not entry[2]:
+                heapq.heappop(order)
+
+            elif ready is None or ready(entry[1]):
+                address = entry[1]
+                break
+
+            else:
+                skipped.append(heapq.heappop(order))
+
+        for entry in skipped:
+            heapq.heappush(order, entry)
+
+        return address
+
+    def ___turn (self, ready = None):
+
+        """ Next address of the ring accepted by ready, it goes to the back of the ring, None if there is none """
+
+        if self.__policy is not None:
+            return self.___first(ready)
+
+        hosts = self.__hosts
+        ring = self.__ring
+
+        for _ in range(len(ring)):
+            address = ring.popleft()
+
+            if address not in hosts:
+                self.__ringed.discard(address)
+                continue
+
+            ring.append(address)
+
+            if ready is None or ready(address):
+                return address
+
+        return None
+
+    def __init__ (self, graph = None, seen = None, spill = None, window = 100000, policy = None):
+
+        self.__table = URLTable()
+        self.__graph = graph
+        self.__seen = seen
+        self.__spill = spill
+        self.__window = max(2, window)
+        self.__policy = policy
+
+        # per url id: links from a starting url and times linked, when ordered by a policy
+        self.__depths = array.array('q') if policy is not None else None
+        self.__counts = array.array('q') if policy is not None else None
+
+        # how many queue items and redirects use each url id, when urls can be released
+        self.__pins = array.array('q') if graph is not None and seen is not None else None
+
+        # per url id: the id it redirects to or -1, a pointer towards its final target or -1,
+        # and None, one referrer id or a set of them (True if kept in the graph)
+        self.__redirects = array.array('q')
+        self.__targets = array.array('q')
+        self.__referrers = []
+
+        # url id -> ids redirecting to it
+        self.__sources = {}
+
+        # address -> URLHost, only hosts with queued items, which take turns in the ring
+        self.__hosts = {}
+        self.__ring = collections.deque()
+        self.__ringed = set()
+
+        # heap of the hosts by the key of their first url, and the valid entry of each, when ordered by a policy
+        self.__order = []
+        self.__order_entries = {}
 
         self.__address = None
 
-        self.__first = None
-        self.__last = None
+        # queued items in memory
+        self.__held = 0
 
     def push_redirect (self, url, page, *extra, front = False):
 
-        redir = url
+        url_id = self.___intern(url)
+        page_id = self.___intern(page)
+
+        redirects = self.__redirects
+
+        if self.___cycle(url_id, page_id):
+            road = [ url ]
+            redir = url_id
+
+            while redir != page_id and redirects[redir] != page_id:
+                road.append(self.__table[redir])
+                redir = redirects[redir]
 
-        road = [ redir ]
+            self.___settle(url_id)
+            self.___settle(page_id)
 
-        if url == page:
             raise InfiniteRedirection('Infinite url redirection.', road)
 
-        while redir in self.__redirects:
-            if self.__redirects[redir] == page:
-                raise InfiniteRedirection('Infinite url redirection.', road)
-            road.append(redir)
-            redir = self.__redirects[redir]
+        old_id = redirects[page_id]
+
+        if old_id != -1:
+            # page_id redirects elsewhere now, the paths compressed past it only go as far as it again
+            sources = self.__sources[old_id]
+            sources.remove(page_id)
+
+            if not sources:
+                del self.__sources[old_id]
+
+            for node, _ in self.___tree(page_id):
+                if node != page_id:
+                    self.__targets[node] = page_id
         else:
-            self.__redirects[page] = url
+            self.___pin(page_id)
 
-            insert = False
+        self.___pin(url_id)
 
-            if url not in self.__linked:
-                self.__linked[url] = {}
-                insert = True
+        target_id = self.___find(url_id)
 
-            for location, roads in self.__linked[page].items():
-                if not location in self.__linked[url]:
-                    self.__linked[url][location] = set()
-                for road in roads:
-                    self.__linked[url][location].add(road + ( page, ))
+        redirects[page_id] = url_id
+        self.__targets[page_id] = target_id
+        self.__sources.setdefault(url_id, []).append(page_id)
 
-            self.__linked[page].clear()
+        if old_id != -1:
+            self.___unpin(old_id)
 
-            return insert and self.___force_push(url, page, *extra, front = front)
+        insert = self.___new(url_id)
 
-        return False
+        if self.__policy is not None:
+            self.___rank(url_id, self.__depths[page_id], self.__counts[page_id], insert)
+
+        # mark both as seen
+        for seen_id in ( url_id, page_id ):
+            if self.__referrers[seen_id] is None:
+                self.__referrers[seen_id] = True if self.__graph is not None else set()
+
+        return insert and self.___force_push(url_id, page_id, extra, front = front)
 
     def push (self, url, page, *extra, front = False):
 
-        road = ()
+        url_id = self.___intern(url)
+        page_id = self.___intern(page)
 
-        while url in self.__redirects:
-            road += ( url, )
-            url = self.__redirects[url]
+        target_id = self.___find(url_id)
 
-        insert = False
+        insert = self.___new(target_id)
 
-        if url not in self.__linked:
-            self.__linked[url] = {}
-            insert = True
+        if self.__policy is not None:
+            self.___rank(target_id, 0 if target_id == page_id else self.__depths[page_id] + 1, 1, insert)
 
-        self.__linked[url].setdefault(page, set()).add(road)
+        self.___refer(url_id, page_id)
 
-        return insert and self.___force_push(url, page, *extra, front = front)
+        queued = insert and self.___force_push(target_id, page_id, extra, front = front)
 
-    def pop_url (self):
-        item = None
+        self.___settle(target_id)
+        self.___settle(page_id)
 
-        if not self.empty_domain:
-            item, self.__first = self.__first
-            self.__size -= 1
+        return queued
 
-        return item
+    def requeue (self, url, page, *extra, front = False):
 
-    def change_domain (self, address = None):
+        """ Queues an already known url again, used when a fetch must be retried """
 
-        old_domain = []
+        self.___force_push(self.___intern(url), self.___intern(page), extra, front = front)
 
-        while not self.empty_domain:
-            old_domain.append(self.pop_url())
+    def retain (self, keep):
 
-        if address is not None:
-            try:
-                urls = self.__external.pop(address)
-            except KeyError:
-                urls = []
+        """
+            Drops the queued items whose url keep(url) rejects, the others keep their place
+            Queues are walked by popping every item and queueing it again at their back, spilled items a chunk at a time
+        """
 
-            self.__address = address
-        else:
-            self.__address, urls = self.__external.popitem()
+        table = self.__table
+
+        for address in list(self.__hosts):
+            host = self.__hosts[address]
+
+            if self.__policy is not None:
+                # heaps hold all of their items in memory and keep the keys of the ones left
+                removed = host.head.retain(lambda item: keep(table[item[0]]))
+
+                self.__held -= len(removed)
+                self.___drop(removed)
+
+                if not host.head:
+                    del self.__hosts[address]
+
+                self.___reorder(address)
+                continue
+
+            count = len(host.head) + len(host.tail) + ( self.__spill.count(address) if self.__spill is not None else 0 )
+
+            for _ in range(count):
+                url, page, *extra = self.pop_url(address)
+
+                if keep(url):
+                    self.requeue(url, page, *extra)
+
+    def pop_url (self, address = None):
+
+        """ Pops the first item of the host of address, the current one by default, None if it has none """
+
+        if address is None:
+            address = self.__address
+
+        host = self.__hosts.get(address)
+
+        if host is None:
+            return None
+
+        if not host.head:
+            self.___load(address, host)
+
+        queued = host.head.popleft()
+        item = self.___item(queued)
+
+        self.__held -= 1
+
+        if not host.head and not host.tail and not self.___spilled(address):
+            del self.__hosts[address]
+
+        if self.__policy is not None:
+            self.___reorder(address)
+
+        self.___unpin(queued[0])
+        self.___unpin(queued[1])
+
+        return item
 
-        for data in urls:
-            self.___force_push(*data)
+    def pop_ready (self, ready):
 
-        for data in old_domain:
-            self.___force_push(*data)
+        """ Pops the first item of the next host in turn for which ready(address) is true, None if no host is ready """
+
+        address = self.___turn(ready)
+        return None if address is None else self.pop_url(address)
+
+    def change_domain (self, address = None):
+
+        """ Makes address the current host, the next one in turn by default, its items stay where they are queued """
+
+        self.__address = self.___turn() if address is None else address
 
     def pop_domain (self, address = None):
-        self.clear_domain()
-        if not self.empty:
-            self.change_domain(address)
-        else:
-            self.__address = None
+
+        """ Moves to the next host in turn, the items left on the current one wait for its next turn """
+
+        self.change_domain(address)
         return self.__address
 
+    def ___drop (self, items):
+        if self.__pins is not None:
+            for url_id, page_id, *_ in items:
+                self.___unpin(url_id)
+                self.___unpin(page_id)
+
+    def ___clear_host (self, address):
+
+        host = self.__hosts.pop(address, None)
+
+        if host is not None:
+            self.___drop(host.head)
+            self.___drop(host.tail)
+            self.__held -= len(host.head) + len(host.tail)
+
+        if self.__spill is not None:
+            self.__spill.drop(address)
+
+        if self.__policy is not None:
+            self.___reorder(address)
+
     def clear_domain (self):
-        self.__size = 0
-        self.__last = self.__first = None
+        self.___clear_host(self.__address)
         self.__address = None
 
     def clear (self):
-        self.__external.clear()
-        self.clear_domain()
+
+        for address in list(self.__hosts):
+            self.___clear_host(address)
+
+        self.__ring.clear()
+        self.__ringed.clear()
+        self.__order = []
+        self.__order_entries.clear()
+        self.__address = None
+
+    def ___pages (self, url_id):
+
+        referrers = self.__referrers[url_id]
+
+        if referrers is None or referrers is True:
+            return ()
+
+        if type(referrers) is int:
+            return ( referrers, )
+
+        return tuple(referrers)
 
     def references (self, url):
-        if url in self.__linked:
-            for page in self.__linked[url]:
-                yield page
+
+        """ Pages linking to url or to the urls redirected to it, none if url redirects """
+
+        url_id = self.__table.get(url)
+
+        if url_id is None:
+            # released urls take part in no redirect
+            if self.__graph is not None:
+                yield from self.__graph.references(url)
+            return
+
+        if self.__redirects[url_id] != -1:
+            return
+
+        pages = set()
+
+        for node, _ in self.___tree(url_id):
+            for page in self.___linked(node):
+                if page not in pages:
+                    pages.add(page)
+                    yield page
+
+    def edges (self):
+
+        """ Yields every ( url, page, road ) reference, road is the tuple of redirects between page and url """
+
+        table = self.__table
+
+        if self.__graph is not None:
+            for url, page in self.__graph.edges():
+                url_id = table.get(url)
+
+                if url_id is None or self.__redirects[url_id] == -1:
+                    yield url, page, ()
+                else:
+                    target_id = self.___find(url_id)
+                    yield table[target_id], page, self.___road(url_id, target_id)
+
+            return
+
+        for url_id in range(len(table)):
+            if self.__redirects[url_id] == -1:
+                for node, road in self.___tree(url_id):
+                    for page_id in self.___pages(node):
+                        yield table[url_id], table[page_id], tuple(table[redir] for redir in road)
+
+    def export (self, fname):
+
+        """ Writes the reference graph to fname, one tab separated page, url and redirects line per reference """
+
+        with open(fname, 'w', encoding = 'utf-8') as output:
+            for url, page, road in self.edges():
+                print(page.encoded, url.encoded, ' '.join(redir.encoded for redir in road), sep = '\t', file = output)
+
+    def flush (self):
+        if self.__graph is not None:
+            self.__graph.flush()
+
+    def close (self):
+
+        if self.__graph is not None:
+            self.__graph.close()
+
+        if self.__spill is not None:
+            self.__spill.close()
+
+    def seen (self):
+
+        if self.__pins is not None:
+            yield from self.__graph.urls()
+            return
+
+        for url_id, referrers in enumerate(self.__referrers):
+            if referrers is not None:
+                yield self.__table[url_id]
+
+    def hosts (self):
+
+        """ Addresses with queued items, in the order they take turns """
+
+        for address in self.__ring:
+            if address in self.__hosts:
+                yield address
+
+    def domains (self):
+
+        """ Addresses waiting to be crawled after the current one """
+
+        for address in self.hosts():
+            if address != self.__address:
+                yield address
 
     @property
     def empty_domain (self):
-        return self.size_domain is 0
+        return self.__address not in self.__hosts
 
     @property
     def empty (self):
-        return self.empty_domain and len(self.__external) is 0
+        return not self.__hosts
 
     @property
     def size_domain (self):
-        return self.__size
+
+        host = self.__hosts.get(self.__address)
+
+        if host is None:
+            return 0
+
+        return len(host.head) + len(host.tail) + ( self.__spill.count(self.__address) if self.__spill is not None else 0 )
 
     @property
     def size (self):
-        return self.size_domain + sum(map(len, self.__external.values()))
+        return self.__held + ( self.__spill.size if self.__spill is not None else 0 )
 
     @property
     def external (self):
-        return copy.deepcopy(self.__external)
+        return {
+            address: [ self.___item(item) for item in host.head ] + ( list(self.__spill.peek(address)) if self.__spill is not None else [] ) + [ self.___item(item) for item in host.tail ]
+            for address, host in self.__hosts.items() if address != self.__address
+        }
 
     def __len__ (self):
         return self.size_domain
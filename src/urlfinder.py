@@ -19,6 +19,9 @@ class URLFinder (object, metaclass = abc.ABCMeta):
 
         return False
 
+    def _forget_code (self):
+        self.__code = None
+
     def __init__ (self, code, canonical, charset):
         self._start(code, canonical, charset)
 
@@ -58,15 +61,21 @@ class URLFinderCSS (URLFinder):
         if match_charset is not None:
             self._change_charset(match_charset.group(2))
 
+        links = []
+        imports = []
+
         for match in URLFinderCSS.match_css_url.finditer(self.code):
+            links.append(match.group(4).strip())
+            if match.group(1) == '@import':
+                imports.append(links[-1])
+
+        self.__urls.update(canonical.hyperlink_many(links))
+
+        for link in imports:
             try:
-                url = canonical.hyperlink(match.group(4).strip())
+                self.__imports.append(canonical.hyperlink(link))
             except ValueError:
                 pass
-            else:
-                self.__urls.add(url)
-                if match.group(1) == '@import':
-                    self.__imports.append(url)
 
     @property
     def urls (self):
@@ -79,14 +88,13 @@ class URLFinderCSS (URLFinder):
 URLFinderCSS.match_css_url = re.compile(r'(?:(@import)[ \t]+|(url\([ \t]*?)){1,2}(["\'])((?:\\{2})*|(?:.*?[^\\](?:\\{2})*))\3(?(2)[ \t]*?\)|)')
 URLFinderCSS.match_css_charset = re.compile(r'@charset[ \t]+(["\'])((?:\\{2})*|(?:.*?[^\\](?:\\{2})*))\1')
 
-class URLFinderHTML (URLFinder, html.parser.HTMLParser):
+class URLElements (html.parser.HTMLParser):
 
-    def _start (self, code, canonical, charset):
+    """ Element tree of an HTML text, elements are dicts with their tag, attrs and children, forms also list their named fields """
 
-        html.parser.HTMLParser.__init__(self)
-        URLFinder._start(self, code, canonical, charset)
+    def __init__ (self, code):
 
-        self.__urls = []
+        super().__init__()
 
         self.__elements = []
         self.__open_elements = []
@@ -96,23 +104,144 @@ class URLFinderHTML (URLFinder, html.parser.HTMLParser):
 
         self.__tags = {}
 
-        self.__new_charset = self.charset
+        self.feed(code)
+        self.close()
+
+    def handle_starttag (self, tag, tuple_attrs):
+
+        attrs = {}
+        element = { 'tag': tag, 'children': [] }
+
+        for attr, value in tuple_attrs:
+            attrs.setdefault(attr, value)
+
+        element['attrs'] = attrs
+
+        self.__elements.append(element)
+        self.__tags.setdefault(tag, []).append(element)
+
+        if len(self.__open_elements):
+            self.__open_elements[0]['children'].append(element)
+
+        self.__open_elements.append(element)
+
+        if tag == 'form':
+
+            tag_id = attrs.get('id')
+            element['form'] = []
+
+            if tag_id not in self.__forms:
+                self.__forms[tag_id] = [ element ]
+            else:
+                self.__forms[tag_id].append(element)
+
+            self.__active_forms.append(element)
+
+        tag_name = attrs.get('name')
+
+        if tag_name is not None and len(self.__active_forms):
+            for form in self.__active_forms:
+                form['form'].append(element)
+
+        form_owner = attrs.get('form')
+
+        if form_owner is not None and form_owner in self.__forms:
+            for form in self.__forms[form_owner]:
+                form['form'].append(element)
+
+    def handle_endtag (self, tag):
+        tag = tag.strip()
+
+        if tag == 'form':
+            if len(self.__active_forms):
+                self.__active_forms.pop()
+
+        for i, element in enumerate(reversed(self.__open_elements)):
+            if element['tag'] == tag:
+                index = len(self.__open_elements) - i - 1
+                self.__open_elements.pop(index)
+                break
+
+    def by_tag (self, tag):
+        if tag in self.__tags:
+            for element in self.__tags[tag]:
+                yield element
+
+    def forms (self):
+        for forms in self.__forms.values():
+            for form in forms:
+                yield form
+
+    @property
+    def elements (self):
+        return self.__elements
+
+class URLFinderHTML (URLFinder, html.parser.HTMLParser):
+
+    """
+        Finds the urls of an HTML text as ( url, tag, attr, rel ) records without building its elements
+        The text may be given as bytes, decoded with the charset sniffed from them or charset otherwise
+        Text is not handled, script and style bodies are skipped as they arrive, the text is dropped once parsed
+        With tree the text is kept and its URLElements are built the first time by_tag, forms or elements are used
+    """
+
+    def _start (self, code, canonical, charset):
+
+        html.parser.HTMLParser.__init__(self)
+        URLFinder._start(self, code, canonical, charset)
+
+        self.__urls = []
+
+        self.__source = [] if self.__tree else None
+        self.__elements = None
+
+        self.__new_charset = None
         self.feed(self.code)
 
-        if self.__new_charset != self.charset:
+        if self.__new_charset is not None and self.__new_charset != self.charset:
             self._change_charset(self.__new_charset)
 
-    def __init__ (self, code, canonical, charset = 'iso-8859-1'):
+        self._forget_code()
+
+    def __init__ (self, code, canonical, charset = 'iso-8859-1', tree = False):
+
+        self.__tree = tree
+
+        # undecoded bytes are decoded once, with the charset they declare
+        if isinstance(code, bytes):
+            charset = urlutils.sniff_charset(code) or charset
+            code = code.decode(charset, errors = 'ignore')
+
         URLFinder.__init__(self, code, canonical, charset)
 
-    def handle_starttag (self, tag, tuple_attrs):
+    def feed (self, data):
 
-        urls = {}
+        if self.__source is not None:
+            self.__source.append(data)
+            self.__elements = None
+
+        if self.cdata_elem is not None:
+            # inside a script or style body only its end tag matters, HTMLParser would keep the body and search it again
+            data = self.rawdata + data
+            self.rawdata = ''
 
-        form_owner = None
+            end = self.interesting.search(data)
 
+            if end is None:
+                start = data.rfind('<')
+
+                if start >= 0 and URLFinderHTML.end_tag_start[self.cdata_elem].match(data, start):
+                    self.rawdata = data[ start : ]
+                return
+
+            data = data[ end.start() : ]
+
+        super().feed(data)
+
+    def handle_starttag (self, tag, tuple_attrs):
+
+        urls = {}
         attrs = {}
-        element = { 'tag': tag, 'children': [] }
 
         for attr, value in tuple_attrs:
 
@@ -120,15 +249,12 @@ class URLFinderHTML (URLFinder, html.parser.HTMLParser):
 
             if attr == 'href' or attr == 'src':
                 try:
-                    urls[attr] = [ ( self.canonical.hyperlink(value.strip()), element ) ]
+                    urls[attr] = [ self.canonical.hyperlink(value.strip()) ]
                 except ValueError:
                     pass
 
             elif attr == 'style':
-                urls.setdefault('style', [])
-
-                for url in URLFinderCSS(value, self.canonical):
-                    urls['style'].append( ( url, element ) )
+                urls.setdefault('style', []).extend(URLFinderCSS(value, self.canonical))
 
             elif tag == 'meta':
 
@@ -153,13 +279,16 @@ class URLFinderHTML (URLFinder, html.parser.HTMLParser):
                             try:
                                 if data[0] == "'" or data[0] == '"':
                                     data = URLFinderHTML.match_inside_quotes(data).group(2)
-                                urls['content'] = [ ( self.canonical.hyperlink(data), element ) ]
+                                urls['content'] = [ self.canonical.hyperlink(data) ]
                             except ValueError:
                                 pass
                 else:
                     charset = None
 
-                    if attr == 'content' and http_equiv == 'charset':
+                    if attr == 'charset':
+                        charset = value
+
+                    elif attr == 'content' and http_equiv == 'charset':
                         charset = value
 
                     elif attr == 'content' and http_equiv == 'content-type':
@@ -171,69 +300,30 @@ class URLFinderHTML (URLFinder, html.parser.HTMLParser):
                     elif attr == 'http-equiv' and http_equiv == 'content-type':
                         charset = urlutils.content_split(attrs.get('content', '')).get('charset', None)
 
-                    if charset is not None:
-                        self.__new_charset = charset.lower()
-
-        element['attrs'] = attrs
-
-        self.__elements.append(element)
-        self.__tags.setdefault(tag, []).append(element)
-
-        if len(self.__open_elements):
-            self.__open_elements[0]['children'].append(element)
-
-        self.__open_elements.append(element)
-
-        if tag == 'form':
+                    if charset:
+                        self.__new_charset = charset.strip().lower()
 
-            tag_id = attrs.get('id')
-            element['form'] = []
-
-            if tag_id not in self.__forms:
-                self.__forms[tag_id] = [ element ]
-            else:
-                self.__forms[tag_id].append(element)
-
-            self.__active_forms.append(element)
-
-        tag_name = attrs.get('name')
-
-        if tag_name is not None and len(self.__active_forms):
-            for form in self.__active_forms:
-                form['form'].append(element)
-
-        form_owner = attrs.get('form')
-
-        if form_owner is not None:
-            if form_owner in self.__forms:
-                self.__forms[form_owner]['form'].append(element)
+        rel = attrs.get('rel')
 
         for attr, links in urls.items():
-            for url, tag in links:
-                self.__urls.append(( url, element, attr ))
+            for url in links:
+                self.__urls.append(( url, tag, attr, rel ))
 
-    def handle_endtag (self, tag):
-        tag = tag.strip()
+    def ___elements (self):
 
-        if tag == 'form':
-            if len(self.__active_forms):
-                self.__active_forms.pop()
+        if self.__source is None:
+            raise ValueError('Element tree not kept, use tree = True')
 
-        for i, element in enumerate(reversed(self.__open_elements)):
-            if element['tag'] == tag:
-                index = len(self.__open_elements) - i - 1
-                self.__open_elements.pop(index)
-                break
+        if self.__elements is None:
+            self.__elements = URLElements(''.join(self.__source))
+
+        return self.__elements
 
     def by_tag (self, tag):
-        if tag in self.__tags:
-            for element in self.__tags[tag]:
-                yield element
+        return self.___elements().by_tag(tag)
 
     def forms (self):
-        for forms in self.__forms.values():
-            for form in forms:
-                yield form
+        return self.___elements().forms()
 
     @property
     def urls (self):
@@ -241,6 +331,19 @@ class URLFinderHTML (URLFinder, html.parser.HTMLParser):
 
     @property
     def elements (self):
-        return self.__elements
+        return self.___elements().elements
+
+    @property
+    def meta_charset (self):
+
+        """ Charset declared by a meta of the text parsed so far, None if none was found """
+
+        return self.__new_charset
 
 URLFinderHTML.match_inside_quotes = re.compile(r'(["\'])((?:\\{2})*|(?:.*?[^\\](?:\\{2})*))\1')
+
+# text at the end of a script or style body that may be the start of its end tag, as HTMLParser matches it
+URLFinderHTML.end_tag_start = {
+    elem: re.compile(r'<(?:/\s*' + ''.join('(?:' + c for c in elem) + r'\s*' + ')?' * len(elem) + r')?\Z', re.I)
+    for elem in html.parser.HTMLParser.CDATA_CONTENT_ELEMENTS
+}
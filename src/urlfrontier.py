@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+import time, signal, threading
+import multiprocessing as mp, multiprocessing.managers
+
+import urldeque, urlcrawler, urlasync, urlgraph, urlseen, urlspill
+
+from color import Color
+
+
+def parse_address (address):
+
+    """ HOST:PORT is a TCP address, anything else is the path of an Unix socket """
+
+    host, sep, port = address.rpartition(':')
+
+    if sep and port.isdigit() and '/' not in address:
+        return ( host or 'localhost', int(port) )
+
+    return address
+
+class URLFrontier (object):
+
+    """
+        Owns the URLDeque of a distributed crawl and leases batches of urls of one host to remote crawlers
+        A host is leased to one crawler at a time, so the crawlers together stay as polite as a single one
+        Crawlers report back the links, redirects, errors and warnings found, expired leases are queued again
+    """
+
+    def ___expire (self):
+
+        now = time.monotonic()
+
+        for lease_id, ( items, deadline, address ) in list(self.__leases.items()):
+            if deadline < now:
+                del self.__leases[lease_id]
+                self.__leased.discard(address)
+
+                for url, page, *extra in items:
+                    self.__urls.requeue(url, page, *extra, front = True)
+
+    def __init__ (self):
+
+        self.__urls = urldeque.URLDeque()
+
+        self.__lease_size = 100
+        self.__lease_timeout = 300.0
+
+        self.__leases = {}
+        self.__next_lease = 0
+
+        # addresses with a lease out, and crawler id -> last time it asked for a lease
+        self.__leased = set()
+        self.__workers = {}
+        self.__next_worker = 0
+
+        self.__errors = {}
+        self.__warnings = {}
+
+        self.__lock = threading.Lock()
+
+    def configure (self, lease_size, lease_timeout, graph = None, seen = None, spill = None, policy = None):
+
+        """ seen is the ( capacity, error rate ) of an URLSeen, used only along with a graph, spill the ( file, window ) of an URLSpill """
+
+        with self.__lock:
+            self.__lease_size = max(1, lease_size)
+            self.__lease_timeout = lease_timeout
+
+            if graph or spill or policy is not None:
+                self.__urls = urldeque.URLDeque(
+                    urlgraph.URLGraph(graph) if graph else None,
+                    urlseen.URLSeen(*seen) if graph and seen is not None else None,
+                    urlspill.URLSpill(spill[0]) if spill else None,
+                    spill[1] if spill else 100000,
+                    policy
+                )
+
+    def push (self, url, page, *extra, front = False):
+        with self.__lock:
+            return self.__urls.push(url, page, *extra, front = front)
+
+    def join (self):
+
+        """ Registers a crawler, returns the id it asks for leases with and the lease timeout """
+
+        with self.__lock:
+            worker = self.__next_worker
+            self.__next_worker += 1
+
+            self.__workers[worker] = time.monotonic()
+
+            return worker, self.__lease_timeout
+
+    def lease (self, worker):
+
+        """
+            Returns ( lease_id, items ) of one host no other crawler holds, ( None, [] ) while waiting on other leases
+            and None when the crawl is over, the crawler is then forgotten
+        """
+
+        with self.__lock:
+
+            self.___expire()
+
+            urls = self.__urls
+            leased = self.__leased
+
+            item = urls.pop_ready(lambda address: address not in leased)
+
+            if item is None:
+                if urls.empty and not self.__leases:
+                    self.__workers.pop(worker, None)
+                    return None
+
+                self.__workers[worker] = time.monotonic()
+                return ( None, [] )
+
+            self.__workers[worker] = time.monotonic()
+
+            address = item[0].address_encoded
+            items = [ item ]
+
+            while len(items) < self.__lease_size:
+                item = urls.pop_url(address)
+
+                if item is None:
+                    break
+
+                items.append(item)
+
+            lease_id = self.__next_lease
+            self.__next_lease += 1
+
+            self.__leases[lease_id] = ( items, time.monotonic() + self.__lease_timeout, address )
+            leased.add(address)
+
+            return lease_id, items
+
+    def renew (self, lease_id):
+
+        """ Pushes back the deadline of a lease still being crawled, returns False if it had already expired """
+
+        with self.__lock:
+
+            lease = self.__leases.get(lease_id)
+
+            if lease is None:
+                return False
+
+            items, _, address = lease
+            self.__leases[lease_id] = ( items, time.monotonic() + self.__lease_timeout, address )
+
+            return True
+
+    def complete (self, lease_id, operations, errors, warnings):
+
+        """ Applies the results of a lease, returns False if the lease had already expired """
+
+        with self.__lock:
+
+            lease = self.__leases.pop(lease_id, None)
+
+            if lease is None:
+                return False
+
+            self.__leased.discard(lease[2])
+
+            for operation, ( url, page, *extra ), front in operations:
+                if operation == 'redirect':
+                    try:
+                        self.__urls.push_redirect(url, page, *extra, front = front)
+                    except urldeque.InfiniteRedirection as infinite_redir:
+                        self.__errors.setdefault(page, []).append(str(infinite_redir))
+                else:
+                    self.__urls.push(url, page, *extra, front = front)
+
+            for url, messages in errors.items():
+                self.__errors.setdefault(url, []).extend(messages)
+
+            for url, messages in warnings.items():
+                self.__warnings.setdefault(url, []).extend(messages)
+
+            return True
+
+    def finished (self):
+
+        """ Nothing is queued or leased and every crawler was told so, crawlers silent for a lease timeout are given up """
+
+        with self.__lock:
+
+            self.___expire()
+
+            if not self.__urls.empty or self.__leases:
+                return False
+
+            now = time.monotonic()
+
+            return all(seen + self.__lease_timeout < now for seen in self.__workers.values())
+
+    def errors (self):
+        with self.__lock:
+            return dict(self.__errors)
+
+    def warnings (self):
+        with self.__lock:
+            return dict(self.__warnings)
+
+    def references (self, url):
+        with self.__lock:
+            return list(self.__urls.references(url))
+
+    def size (self):
+        with self.__lock:
+            return self.__urls.size, len(self.__leases)
+
+    def flush (self):
+        with self.__lock:
+            self.__urls.flush()
+
+def frontier_instance ():
+    if frontier_instance.frontier is None:
+        frontier_instance.frontier = URLFrontier()
+    return frontier_instance.frontier
+
+frontier_instance.frontier = None
+
+class URLFrontierManager (mp.managers.BaseManager): pass
+
+URLFrontierManager.register('frontier', callable = frontier_instance)
+
+class URLFrontierServer (object):
+
+    """ Serves the frontier of a crawl to remote crawlers and waits for them to finish it, fetches nothing itself """
+
+    def __init__ (self, args, urls, address, authkey, lease_size = 100, lease_timeout = 300.0, poll = 1.0):
+
+        self.__urls = urls
+        self.__manager = URLFrontierManager(address, authkey)
+        self.__lease_size = lease_size
+        self.__lease_timeout = lease_timeout
+        self.__poll = poll
+        self.__graph = args.graph
+        self.__seen = ( args.seen_capacity, args.seen_error ) if args.seen_error is not None else None
+        self.__spill = ( args.spill, args.spill_window ) if args.spill else None
+        self.__policy = args.policy
+
+        self.__frontier = None
+        self.__errors = {}
+        self.__warnings = {}
+
+    def crawl (self):
+
+        urls = self.__urls
+
+        self.__manager.start(lambda: signal.signal(signal.SIGINT, signal.SIG_IGN))
+        self.__frontier = frontier = self.__manager.frontier()
+
+        frontier.configure(self.__lease_size, self.__lease_timeout, self.__graph, self.__seen, self.__spill, self.__policy)
+
+        while not urls.empty:
+            urls.pop_domain()
+            while not urls.empty_domain:
+                frontier.push(*urls.pop_url())
+
+        try:
+            while not frontier.finished():
+                time.sleep(self.__poll)
+        finally:
+            frontier.flush()
+            self.__errors.update(frontier.errors())
+            self.__warnings.update(frontier.warnings())
+
+    def references (self, url):
+        return iter(self.__frontier.references(url) if self.__frontier is not None else ())
+
+    @property
+    def errors (self):
+        return self.__errors
+
+    @property
+    def warnings (self):
+        return self.__warnings
+
+class URLLeaseMixin (object):
+
+    """ Crawler mixin that records the links and redirects found instead of queueing them """
+
+    def __init__ (self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__operations = []
+
+    def push (self, url, page, cookies, charset, front = False):
+        self.__operations.append(( 'push', ( url, page, cookies, charset ), front ))
+        return False
+
+    def push_redirect (self, url, page, cookies, charset, front = False):
+        if url == page:
+            raise urldeque.InfiniteRedirection('Infinite url redirection.', [ url ])
+        self.__operations.append(( 'redirect', ( url, page, cookies, charset ), front ))
+        return False
+
+    def operations (self):
+        operations = self.__operations
+        self.__operations = []
+        return operations
+
+class URLLeaseCrawler (URLLeaseMixin, urlcrawler.URLCrawler): pass
+
+class URLLeaseAsyncCrawler (URLLeaseMixin, urlasync.URLAsyncCrawler): pass
+
+class URLFrontierWorker (object):
+
+    """ Crawls leases of a remote frontier until it reports the crawl is over, renewing the lease being crawled """
+
+    def __init__ (self, args, fixed_cookies, address, authkey, html_queue = None, css_queue = None, js_queue = None, poll = 1.0):
+
+        self.__urls = urldeque.URLDeque()
+
+        if args.engine == 'async':
+            self.__crawler = URLLeaseAsyncCrawler(args, self.__urls, fixed_cookies, html_queue, css_queue, js_queue, concurrency = args.concurrency)
+        else:
+            self.__crawler = URLLeaseCrawler(args, self.__urls, fixed_cookies, html_queue, css_queue, js_queue)
+
+        self.__manager = URLFrontierManager(address, authkey)
+        self.__poll = poll
+        self.__lease = None
+
+    def ___renew (self, frontier, timeout, stop):
+
+        """ Renews the lease being crawled a few times per lease timeout until stop is set """
+
+        while not stop.wait(timeout / 3):
+
+            lease_id = self.__lease
+
+            if lease_id is None:
+                continue
+
+            try:
+                frontier.renew(lease_id)
+            except ( EOFError, ConnectionError ):
+                return
+
+    def crawl (self):
+
+        crawler = self.__crawler
+
+        self.__manager.connect()
+        frontier = self.__manager.frontier()
+        worker, timeout = frontier.join()
+
+        stop = threading.Event()
+        renewer = threading.Thread(target = self.___renew, args = ( frontier, timeout, stop ), daemon = True)
+        renewer.start()
+
+        try:
+            while True:
+
+                try:
+                    lease = frontier.lease(worker)
+                except ( EOFError, ConnectionError ):
+                    print(Color.RED % 'Lost connection to the frontier')
+                    break
+
+                if lease is None:
+                    break
+
+                lease_id, items = lease
+
+                if lease_id is None:
+                    time.sleep(self.__poll)
+                    continue
+
+                self.__urls.clear()
+
+                for url, page, *extra in items:
+                    self.__urls.requeue(url, page, *extra)
+
+                self.__lease = lease_id
+
+                try:
+                    crawler.run()
+                finally:
+                    self.__lease = None
+
+                if not frontier.complete(lease_id, crawler.operations(), crawler.errors, crawler.warnings):
+                    print(Color.YELLOW % 'Lease {0} expired before it was completed, its urls are crawled again'.format(lease_id))
+
+                crawler.errors.clear()
+                crawler.warnings.clear()
+
+        finally:
+            stop.set()
+            renewer.join()
+            crawler.close()
+
+    def references (self, url):
+        return iter(())
+
+    @property
+    def errors (self):
+        return self.__crawler.errors
+
+    @property
+    def warnings (self):
+        return self.__crawler.warnings
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import os, sqlite3
+
+import urlhttp
+
+
+class URLGraph (object):
+
+    """
+        Reference graph of a crawl kept in a sqlite file instead of memory
+        Edges are ( url, page ), page links to url, inserted in batches and stored with the urls in their encoded form
+        Redirects are not stored, the URLDeque resolves them
+    """
+
+    def __init__ (self, fname, batch = 1000):
+
+        directory = os.path.dirname(fname)
+
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+        self.__db = sqlite3.connect(fname, timeout = 30.0, check_same_thread = False)
+        self.__db.execute('DROP TABLE IF EXISTS edges')
+        self.__db.execute('CREATE TABLE edges (url TEXT, page TEXT, PRIMARY KEY (url, page)) WITHOUT ROWID')
+        self.__db.commit()
+
+        self.__batch = max(1, batch)
+        self.__pending = []
+
+    def link (self, url, page):
+
+        self.__pending.append(( url.encoded, page.encoded ))
+
+        if len(self.__pending) >= self.__batch:
+            self.flush()
+
+    def flush (self):
+
+        if self.__pending:
+            self.__db.executemany('INSERT OR IGNORE INTO edges (url, page) VALUES (?, ?)', self.__pending)
+            self.__pending = []
+
+        self.__db.commit()
+
+    def references (self, url):
+
+        self.flush()
+
+        for page, in self.__db.execute('SELECT page FROM edges WHERE url = ?', ( url.encoded, )).fetchall():
+            yield urlhttp.URLHttp(page)
+
+    def urls (self):
+
+        """ Yields every url referenced """
+
+        self.flush()
+
+        for url, in self.__db.execute('SELECT DISTINCT url FROM edges').fetchall():
+            yield urlhttp.URLHttp(url)
+
+    def edges (self):
+
+        """ Yields every ( url, page ) edge """
+
+        self.flush()
+
+        for url, page in self.__db.execute('SELECT url, page FROM edges ORDER BY url, page'):
+            yield urlhttp.URLHttp(url), urlhttp.URLHttp(page)
+
+    def close (self):
+        self.flush()
+        self.__db.close()
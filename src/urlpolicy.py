@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import abc, heapq, itertools
+
+
+class URLPolicy (object, metaclass = abc.ABCMeta):
+
+    """
+        Orders the queued urls of a host, urls with lower keys are crawled first, ties in push order
+        Keys of dynamic policies change as urls are referenced again while queued
+    """
+
+    dynamic = False
+
+    @abc.abstractmethod
+    def key (self, depth, references, front):
+
+        """ depth is the number of links from a starting url, references how many times the url was linked, front marks assets """
+
+class BreadthFirst (URLPolicy):
+
+    """ Urls closer to the starting urls first """
+
+    def key (self, depth, references, front):
+        return depth
+
+class AssetsFirst (URLPolicy):
+
+    """ Images, scripts, styles and other urls not linked by an anchor first """
+
+    def key (self, depth, references, front):
+        return 0 if front else 1
+
+class SeedsFirst (URLPolicy):
+
+    """ Starting urls first, then breadth first """
+
+    def key (self, depth, references, front):
+        return 0 if depth == 0 else 1
+
+class FewestReferences (URLPolicy):
+
+    """ Urls linked the fewest times first """
+
+    dynamic = True
+
+    def key (self, depth, references, front):
+        return references
+
+class MostReferences (URLPolicy):
+
+    """ Urls linked the most times first, broken links hurting the most pages are found early """
+
+    dynamic = True
+
+    def key (self, depth, references, front):
+        return -references
+
+URLPolicy.policies = {
+    'bfs': BreadthFirst,
+    'assets': AssetsFirst,
+    'seeds': SeedsFirst,
+    'fewest-refs': FewestReferences,
+    'most-refs': MostReferences
+}
+
+class URLHeap (object):
+
+    """
+        Priority queue of the items of a host with the methods of a deque used by URLDeque, keys come from key(item, front)
+        Changing the key of an item pushes it again and leaves the old entry behind, skipped when it reaches the top
+    """
+
+    def __init__ (self, key):
+
+        self.__key = key
+        self.__heap = []
+        self.__entries = {}
+        self.__size = 0
+
+    def ___push (self, item, front, seq):
+
+        # [ key, seq, item, front, valid ]
+        entry = [ self.__key(item, front), seq, item, front, True ]
+
+        heapq.heappush(self.__heap, entry)
+        self.__entries[item[0]] = entry
+
+    def ___top (self):
+
+        heap = self.__heap
+
+        while heap and not heap[0][4]:
+            heapq.heappop(heap)
+
+        return heap[0] if heap else None
+
+    def append (self, item):
+        self.___push(item, False, next(URLHeap.sequence))
+        self.__size += 1
+
+    def appendleft (self, item):
+        self.___push(item, True, next(URLHeap.sequence))
+        self.__size += 1
+
+    def update (self, url_id):
+
+        """ Computes again the key of the item of url_id if queued here """
+
+        entry = self.__entries.get(url_id)
+
+        if entry is not None and entry[4]:
+            entry[4] = False
+            self.___push(entry[2], entry[3], entry[1])
+
+    def popleft (self):
+
+        entry = self.___top()
+
+        if entry is None:
+            raise IndexError('pop from an empty URLHeap')
+
+        heapq.heappop(self.__heap)
+        self.__size -= 1
+
+        if self.__entries.get(entry[2][0]) is entry:
+            del self.__entries[entry[2][0]]
+
+        return entry[2]
+
+    def retain (self, keep):
+
+        """ Removes the items keep(item) rejects and returns them, the others keep their keys and order """
+
+        removed = []
+
+        for entry in self.__heap:
+            if entry[4] and not keep(entry[2]):
+                entry[4] = False
+                self.__size -= 1
+
+                if self.__entries.get(entry[2][0]) is entry:
+                    del self.__entries[entry[2][0]]
+
+                removed.append(entry[2])
+
+        return removed
+
+    @property
+    def top (self):
+
+        """ Key of the first item, None when empty """
+
+        entry = self.___top()
+        return None if entry is None else ( entry[0], entry[1] )
+
+    def clear (self):
+        self.__heap = []
+        self.__entries = {}
+        self.__size = 0
+
+    def __iter__ (self):
+        return ( entry[2] for entry in self.__heap if entry[4] )
+
+    def __len__ (self):
+        return self.__size
+
+URLHeap.sequence = itertools.count()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import time, socket, selectors, threading
+import http.client
+
+
+class URLConnectionPool (object):
+
+    """ Keeps alive http connections by scheme and netloc, limited per host and evicted when idle """
+
+    @staticmethod
+    def key (url):
+        return url.address_encoded
+
+    @staticmethod
+    def healthy (conn):
+
+        """ An idle keep-alive socket must be open and have nothing to read, otherwise the server closed it """
+
+        if conn.sock is None:
+            return False
+
+        # select.select only takes descriptors below FD_SETSIZE, a selector takes any
+        with selectors.DefaultSelector() as selector:
+            try:
+                selector.register(conn.sock, selectors.EVENT_READ)
+            except ( ValueError, OSError ):
+                return False
+
+            return not selector.select(0)
+
+    def ___evict (self, now):
+
+        for key in list(self.__idle):
+            idle = self.__idle[key]
+
+            while idle and now - idle[0][1] > self.__idle_timeout:
+                idle.pop(0)[0].close()
+
+            if not idle:
+                del self.__idle[key]
+
+    def __init__ (self, timeout = 5.0, max_per_host = 4, idle_timeout = 30.0):
+
+        self.__timeout = timeout
+        self.__max_per_host = max(1, max_per_host)
+        self.__idle_timeout = idle_timeout
+
+        self.__idle = {}
+        self.__active = {}
+        self.__owner = {}
+
+        self.__cond = threading.Condition()
+
+    def ___create (self, url):
+
+        #TODO support proxies
+        if url.ssl:
+            return http.client.HTTPSConnection(url.netloc_encoded, timeout = self.__timeout)
+        return http.client.HTTPConnection(url.netloc_encoded, timeout = self.__timeout)
+
+    def acquire (self, url, block = True):
+
+        """ Returns a connected connection for the url host, None if it could not connect or block is False and the host is full """
+
+        key = URLConnectionPool.key(url)
+
+        with self.__cond:
+            while True:
+                self.___evict(time.monotonic())
+
+                idle = self.__idle.get(key)
+
+                while idle:
+                    conn = idle.pop()[0]
+
+                    if URLConnectionPool.healthy(conn):
+                        self.__active[key] = self.__active.get(key, 0) + 1
+                        self.__owner[conn] = key
+                        return conn
+
+                    conn.close()
+
+                if self.__active.get(key, 0) < self.__max_per_host:
+                    self.__active[key] = self.__active.get(key, 0) + 1
+                    break
+
+                if not block:
+                    return None
+
+                self.__cond.wait()
+
+        conn = self.___create(url)
+
+        try:
+            conn.connect()
+        except ( socket.error, ConnectionError ):
+            conn.close()
+
+            with self.__cond:
+                self.__active[key] -= 1
+                self.__cond.notify_all()
+
+            return None
+
+        with self.__cond:
+            self.__owner[conn] = key
+
+        return conn
+
+    def release (self, conn, reuse = True):
+
+        with self.__cond:
+            key = self.__owner.pop(conn)
+            self.__active[key] -= 1
+
+            if reuse and conn.sock is not None:
+                self.__idle.setdefault(key, []).append(( conn, time.monotonic() ))
+            else:
+                conn.close()
+
+            self.__cond.notify_all()
+
+    def discard (self, conn):
+        self.release(conn, reuse = False)
+
+    def available (self, url):
+        with self.__cond:
+            return self.__active.get(URLConnectionPool.key(url), 0) < self.__max_per_host
+
+    def close (self):
+        with self.__cond:
+            for idle in self.__idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self.__idle.clear()
+
+    @property
+    def max_per_host (self):
+        return self.__max_per_host
+
+    def __len__ (self):
+        with self.__cond:
+            return sum(map(len, self.__idle.values())) + sum(self.__active.values())
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+import os, re, time, sqlite3, threading, concurrent.futures
+import urllib.parse
+
+import urlutils, urlhttp
+
+from color import Color
+
+
+def robots_path (path):
+
+    """ Normalizes the percent encoding of a path, patterns and paths must be compared in the same form """
+
+    return urllib.parse.quote(urllib.parse.unquote(path), safe = robots_path.safe)
+
+robots_path.safe = "/?=&;:@!$,'()*+~"
+
+class RobotsPolicy (object):
+
+    """
+        Rules of a robots.txt for one user agent, compiled to a single regular expression
+        The alternatives are sorted by length so the first one matching is the longest rule, allow wins ties
+    """
+
+    @staticmethod
+    def ___pattern (path):
+
+        end = path.endswith('$')
+
+        if end:
+            path = path[ : -1 ]
+
+        pattern = '.*'.join(map(re.escape, robots_path(path).split('*')))
+
+        return pattern + '\\Z' if end else pattern
+
+    @staticmethod
+    def ___groups (text):
+
+        """ Returns the ( agents, rules, crawl delays ) groups of a robots.txt """
+
+        groups = []
+        agents = None
+
+        for line in text.splitlines():
+
+            key, sep, value = line.split('#', 1)[0].partition(':')
+
+            if not sep:
+                continue
+
+            key = key.strip().lower()
+            value = value.strip()
+
+            if key == 'user-agent':
+                if agents is None:
+                    agents = []
+                    groups.append(( agents, [], [] ))
+
+                if value:
+                    agents.append(value.lower())
+
+            elif groups:
+                agents = None
+                _, rules, delays = groups[-1]
+
+                if key in ( 'allow', 'disallow' ) and value:
+                    rules.append(( key == 'allow', value ))
+
+                elif key == 'crawl-delay':
+                    try:
+                        delays.append(float(value))
+                    except ValueError:
+                        pass
+
+        return groups
+
+    def __init__ (self, text = '', user_agent = '*', allow_all = False, disallow_all = False):
+
+        self.__allow_all = allow_all
+        self.__disallow_all = disallow_all
+
+        token = user_agent.split('/')[0].strip().lower()
+        groups = RobotsPolicy.___groups(text)
+
+        chosen = [ group for group in groups if any(agent != '*' and agent in token for agent in group[0]) ]
+        chosen = chosen or [ group for group in groups if '*' in group[0] ]
+
+        rules = [ rule for _, group_rules, _ in chosen for rule in group_rules ]
+        delays = [ delay for _, _, group_delays in chosen for delay in group_delays ]
+
+        self.__crawl_delay = max(delays) if delays else 0.0
+
+        rules.sort(key = lambda rule: ( -len(rule[1]), not rule[0] ))
+
+        self.__allows = [ allow for allow, _ in rules ]
+        self.__matcher = re.compile('|'.join('({0})'.format(RobotsPolicy.___pattern(path)) for _, path in rules)) if rules else None
+
+    def allowed (self, url):
+
+        if self.__allow_all:
+            return True
+
+        if self.__disallow_all:
+            return False
+
+        if self.__matcher is None:
+            return True
+
+        path = robots_path(url.request_encoded)
+
+        if path == '/robots.txt':
+            return True
+
+        match = self.__matcher.match(path)
+
+        return match is None or self.__allows[match.lastindex - 1]
+
+    @property
+    def crawl_delay (self):
+        return self.__crawl_delay
+
+class URLRobots (object):
+
+    """
+        Robots policies per host, fetched through the connection pool and kept ttl seconds in memory and in an optional sqlite file
+        Policies of hosts about to be crawled can be fetched in background
+    """
+
+    @staticmethod
+    def policy (status, text, user_agent):
+        if status in ( 401, 403 ):
+            return RobotsPolicy(disallow_all = True)
+        if status >= 400:
+            return RobotsPolicy(allow_all = True)
+        return RobotsPolicy(text, user_agent)
+
+    def __init__ (self, user_agent, pool, ttl = 86400.0, fname = None, prefetch = 4):
+
+        self.__user_agent = user_agent
+        self.__pool = pool
+        self.__ttl = ttl
+        self.__prefetch = max(1, prefetch)
+
+        self.__policies = {}
+        self.__locks = {}
+        self.__lock = threading.Lock()
+
+        self.__executor = None
+        self.__prefetching = set()
+
+        self.__db = None
+
+        if fname:
+            directory = os.path.dirname(fname)
+
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+
+            self.__db = sqlite3.connect(fname, timeout = 30.0, check_same_thread = False)
+            self.__db.execute('CREATE TABLE IF NOT EXISTS robots (address TEXT PRIMARY KEY, fetched REAL, status INTEGER, body TEXT)')
+            self.__db.commit()
+
+    def ___load (self, address):
+
+        """ Returns ( policy, seconds left ) of a fresh stored robots.txt or None """
+
+        with self.__lock:
+            row = self.__db.execute('SELECT fetched, status, body FROM robots WHERE address = ?', ( address, )).fetchone()
+
+        if row is None:
+            return None
+
+        fetched, status, body = row
+        left = fetched + self.__ttl - time.time()
+
+        if left <= 0:
+            return None
+
+        return URLRobots.policy(status, body, self.__user_agent), left
+
+    def ___store (self, address, status, body):
+        with self.__lock:
+            self.__db.execute('INSERT OR REPLACE INTO robots (address, fetched, status, body) VALUES (?, ?, ?, ?)', ( address, time.time(), status, body ))
+            self.__db.commit()
+
+    def cached (self, url):
+
+        """ Policy known for the host of url without fetching it, None if unknown or not available """
+
+        entry = self.__policies.get(url.address_encoded)
+
+        if entry is None or entry[1] < time.monotonic():
+            return None
+
+        return entry[0]
+
+    def get (self, url):
+
+        """ Policy for the host of url, None if its robots.txt could not be fetched, safe to call from many threads """
+
+        address = url.address_encoded
+
+        with self.__lock:
+            lock = self.__locks.setdefault(address, threading.Lock())
+
+        with lock:
+
+            entry = self.__policies.get(address)
+
+            if entry is not None and entry[1] >= time.monotonic():
+                return entry[0]
+
+            stored = self.___load(address) if self.__db is not None else None
+
+            if stored is not None:
+                policy, left = stored
+
+            else:
+                left = self.__ttl
+                fetched = urlutils.fetch_robots(url, self.__pool, headers = { 'User-Agent': self.__user_agent })
+
+                if fetched is None:
+                    print(Color.RED % 'Could not fetch robots.txt at {0}'.format(url.address))
+                    policy = None
+
+                    # a failure may be transient, robots.txt is asked for again soon
+                    left = min(left, URLRobots.retry)
+                else:
+                    status, body = fetched
+                    policy = URLRobots.policy(status, body, self.__user_agent)
+
+                    if self.__db is not None:
+                        self.___store(address, status, body)
+
+            self.__policies[address] = ( policy, time.monotonic() + left )
+
+        return policy
+
+    def ___prefetched (self, address):
+        try:
+            self.get(urlhttp.URLHttp(address))
+        finally:
+            with self.__lock:
+                self.__prefetching.discard(address)
+
+    def prefetch (self, addresses):
+
+        """ Fetches in background the policies of the given hosts not known yet """
+
+        now = time.monotonic()
+
+        for address in addresses:
+
+            entry = self.__policies.get(address)
+
+            if entry is not None and entry[1] >= now:
+                continue
+
+            with self.__lock:
+                if address in self.__prefetching:
+                    continue
+
+                self.__prefetching.add(address)
+
+                if self.__executor is None:
+                    self.__executor = concurrent.futures.ThreadPoolExecutor(self.__prefetch)
+
+            self.__executor.submit(self.___prefetched, address)
+
+    def stop (self):
+
+        """ Drops the pending background fetches and waits for the running ones """
+
+        with self.__lock:
+            executor = self.__executor
+            self.__executor = None
+
+        if executor is not None:
+            executor.shutdown(wait = True, cancel_futures = True)
+
+        with self.__lock:
+            self.__prefetching.clear()
+
+    def close (self):
+
+        self.stop()
+
+        if self.__db is not None:
+            self.__db.close()
+            self.__db = None
+
+URLRobots.retry = 60.0
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import math
+
+
+class BloomFilter (object):
+
+    """ Bloom filter of a fixed capacity over 64 bit hashes, bit positions come from double hashing """
+
+    def __init__ (self, capacity, error_rate):
+
+        size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+
+        self.__size = size
+        self.__hashes = max(1, round(size / capacity * math.log(2)))
+        self.__bits = bytearray((size + 7) // 8)
+
+        self.__capacity = capacity
+        self.__count = 0
+
+    def ___positions (self, value):
+
+        low = value & 0xFFFFFFFF
+        high = ( value >> 32 ) | 1
+
+        for index in range(self.__hashes):
+            yield ( low + index * high ) % self.__size
+
+    def add (self, value):
+
+        """ Adds value, returns True if it was not in the filter """
+
+        bits = self.__bits
+        new = False
+
+        for position in self.___positions(value):
+            byte, mask = position >> 3, 1 << ( position & 7 )
+
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+
+        if new:
+            self.__count += 1
+
+        return new
+
+    def __contains__ (self, value):
+        bits = self.__bits
+        return all(bits[position >> 3] & ( 1 << ( position & 7 ) ) for position in self.___positions(value))
+
+    def __len__ (self):
+        return self.__count
+
+    @property
+    def full (self):
+        return self.__count >= self.__capacity
+
+    @property
+    def nbytes (self):
+        return len(self.__bits)
+
+class URLSeen (object):
+
+    """
+        Set of the urls seen by a crawl with a bounded false positive rate, a scalable Bloom filter over the url hashes
+        Filters are added as the previous one fills, each twice as large with half its error rate
+        A false positive makes a new url look already seen, it is not crawled
+    """
+
+    def __init__ (self, capacity = 1 << 20, error_rate = 0.001):
+
+        self.__capacity = max(1, capacity)
+        self.__error_rate = error_rate * ( 1 - URLSeen.tightening )
+
+        self.__filters = [ BloomFilter(self.__capacity, self.__error_rate) ]
+
+    def ___hash (self, url):
+        return hash(url) & 0xFFFFFFFFFFFFFFFF
+
+    def add (self, url):
+
+        """ Adds url, returns True if it had not been seen """
+
+        value = self.___hash(url)
+
+        if any(value in bloom for bloom in self.__filters):
+            return False
+
+        if self.__filters[-1].full:
+            self.__capacity *= URLSeen.growth
+            self.__error_rate *= URLSeen.tightening
+            self.__filters.append(BloomFilter(self.__capacity, self.__error_rate))
+
+        return self.__filters[-1].add(value)
+
+    def __contains__ (self, url):
+        value = self.___hash(url)
+        return any(value in bloom for bloom in self.__filters)
+
+    def __len__ (self):
+        return sum(map(len, self.__filters))
+
+    @property
+    def nbytes (self):
+        return sum(bloom.nbytes for bloom in self.__filters)
+
+URLSeen.growth = 2
+URLSeen.tightening = 0.5
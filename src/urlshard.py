@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+import os, zlib, queue, signal
+import multiprocessing as mp
+
+import urldeque, urlcrawler, urlasync, urlgraph, urlseen, urlspill
+
+from color import Color
+
+
+class ShardDied (Exception):
+
+    def __init__ (self):
+        self.value = 'A crawler process exited before the crawl finished.'
+
+    def __str__ (self):
+        return str(self.value)
+
+def shard_of (url, count):
+    return zlib.crc32(url.address_encoded.encode('utf-8')) % count
+
+class URLShardMixin (object):
+
+    """
+        Crawler mixin that keeps only the hosts hashed to its shard and forwards every other link to its owner
+        A redirect to another shard moves the redirecting url there with its referrers, later links to it follow it
+    """
+
+    def __init__ (self, *args, shard_index = 0, shard_count = 1, outbox = None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.__index = shard_index
+        self.__count = shard_count
+        self.__outbox = outbox
+
+        # url -> urls redirecting to it, directly or not, as far as this shard knows
+        self.__roads = {}
+
+        # redirecting url -> ( shard holding its redirect, url it is known as there )
+        self.__owners = {}
+
+    def ___owner (self, url):
+        return self.__owners.get(url) or ( shard_of(url, self.__count), url )
+
+    def push (self, url, page, cookies, charset, front = False):
+
+        shard, known = self.___owner(url)
+
+        if shard == self.__index:
+            return super().push(url, page, cookies, charset, front = front)
+
+        self.__outbox.put(( 'push', shard, ( known, page, cookies, charset ), front ))
+        return False
+
+    def push_redirect (self, url, page, cookies, charset, front = False):
+        return self.redirect(url, page, cookies, charset, front = front)
+
+    def redirect (self, url, page, cookies, charset, front = False, referrers = None, road = frozenset()):
+
+        """
+            Redirects page to url on the shard owning url, referrers and road come along from the shard page redirected from
+            road holds the urls redirecting to page, a redirect back to one of them is a loop
+        """
+
+        road = road | self.__roads.get(page, frozenset()) | { page }
+
+        if url in road:
+            raise urldeque.InfiniteRedirection('Infinite url redirection.', [ url, page ])
+
+        self.__roads[url] = self.__roads.get(url, frozenset()) | road
+
+        shard, known = self.___owner(url)
+
+        for redirected in road:
+            self.__owners[redirected] = ( shard, page )
+
+        if shard != self.__index:
+            if referrers is None:
+                referrers = list(self.references(page))
+
+            self.__outbox.put(( 'redirect', shard, ( known, page, cookies, charset ), front, referrers, road ))
+            return False
+
+        result = super().push_redirect(url, page, cookies, charset, front = front)
+
+        # page is seen and redirects to url here, its referrers only link to it
+        for referrer in referrers or ():
+            super().push(page, referrer, cookies, charset)
+
+        return result
+
+class URLShardCrawler (URLShardMixin, urlcrawler.URLCrawler): pass
+
+class URLShardAsyncCrawler (URLShardMixin, urlasync.URLAsyncCrawler): pass
+
+class URLShards (object):
+
+    """
+        Crawls with many worker processes, each one owning the hosts hashed to it and its own URLDeque
+        Links to hosts of other shards are forwarded through this process, results are merged at the end
+    """
+
+    @staticmethod
+    def worker (index, count, args, fixed_cookies, queues, inbox, outbox):
+
+        urls = urldeque.URLDeque(
+            urlgraph.URLGraph('{0}.{1}'.format(args.graph, index)) if args.graph else None,
+            urlseen.URLSeen(args.seen_capacity, args.seen_error) if args.seen_error is not None else None,
+            urlspill.URLSpill('{0}.{1}'.format(args.spill, index)) if args.spill else None,
+            args.spill_window,
+            args.policy
+        )
+
+        if args.engine == 'async':
+            crawler = URLShardAsyncCrawler(args, urls, fixed_cookies, *queues, concurrency = args.concurrency, shard_index = index, shard_count = count, outbox = outbox)
+        else:
+            crawler = URLShardCrawler(args, urls, fixed_cookies, *queues, shard_index = index, shard_count = count, outbox = outbox)
+
+        received = 0
+
+        try:
+            while True:
+
+                if urls.empty:
+                    outbox.put(( 'idle', index, received ))
+                    message = inbox.get()
+                else:
+                    try:
+                        message = inbox.get_nowait()
+                    except queue.Empty:
+                        crawler.run()
+                        continue
+
+                if message[0] == 'stop':
+                    break
+
+                if message[0] == 'redirect':
+                    _, item, front, referrers, road = message
+
+                    try:
+                        crawler.redirect(*item, front = front, referrers = referrers, road = road)
+                    except urldeque.InfiniteRedirection as infinite_redir:
+                        url, page = item[ : 2 ]
+                        print(Color.RED % 'Redirection loop detected!')
+                        print(Color.RED % '{0} --> ... --> {1} --> ... --> {0}'.format(page, url))
+                        crawler.error(page, str(infinite_redir))
+                else:
+                    _, item, front = message
+                    crawler.push(*item, front = front)
+
+                received += 1
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            crawler.close()
+
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        if args.valid_html or args.valid_css or args.valid_js:
+            report = urls.seen()
+        else:
+            report = crawler.errors.keys() | crawler.warnings.keys()
+
+        references = { url: list(crawler.references(url)) for url in report }
+
+        urls.close()
+
+        outbox.put(( 'done', index, crawler.errors, crawler.warnings, references ))
+
+    def __init__ (self, args, urls, fixed_cookies, html_queue = None, css_queue = None, js_queue = None, workers = 2):
+
+        self.__args = args
+        self.__urls = urls
+        self.__fixed_cookies = fixed_cookies
+        self.__queues = ( html_queue, css_queue, js_queue )
+        self.__count = max(1, workers)
+
+        self.__errors = {}
+        self.__warnings = {}
+        self.__references = {}
+
+    def ___merge (self, errors, warnings, references):
+
+        for url, messages in errors.items():
+            self.__errors.setdefault(url, []).extend(messages)
+
+        for url, messages in warnings.items():
+            self.__warnings.setdefault(url, []).extend(messages)
+
+        for url, pages in references.items():
+            known = self.__references.setdefault(url, [])
+            known.extend(page for page in pages if page not in known)
+
+    def crawl (self):
+
+        urls = self.__urls
+        count = self.__count
+
+        outbox = mp.Queue()
+        inboxes = [ mp.Queue() for _ in range(count) ]
+
+        sent = [ 0 ] * count
+        idle = [ None ] * count
+
+        processes = [
+            mp.Process(target = URLShards.worker, args = ( index, count, self.__args, self.__fixed_cookies, self.__queues, inboxes[index], outbox ))
+            for index in range(count)
+        ]
+
+        for process in processes:
+            process.start()
+
+        try:
+            while not urls.empty:
+                urls.pop_domain()
+                while not urls.empty_domain:
+                    url, page, *extra = urls.pop_url()
+                    shard = shard_of(url, count)
+                    inboxes[shard].put(( 'push', ( url, page ) + tuple(extra), False ))
+                    sent[shard] += 1
+
+            while any(idle[index] != sent[index] for index in range(count)):
+
+                try:
+                    message = outbox.get(timeout = 1.0)
+                except queue.Empty:
+                    if all(process.is_alive() for process in processes):
+                        continue
+                    raise ShardDied()
+
+                if message[0] in ( 'push', 'redirect' ):
+                    kind, shard, *forward = message
+                    inboxes[shard].put(( kind, *forward ))
+                    sent[shard] += 1
+
+                elif message[0] == 'idle':
+                    _, index, received = message
+                    idle[index] = received
+
+            for inbox in inboxes:
+                inbox.put(( 'stop', ))
+
+        except ( KeyboardInterrupt, ShardDied ):
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGINT)
+
+        done = set()
+
+        while len(done) < count:
+            try:
+                message = outbox.get(timeout = 1.0)
+            except KeyboardInterrupt:
+                continue
+            except queue.Empty:
+                done.update(index for index, process in enumerate(processes) if not process.is_alive())
+                continue
+
+            if message[0] == 'done':
+                self.___merge(*message[ 2 : ])
+                done.add(message[1])
+
+        for process in processes:
+            process.join()
+
+    def references (self, url):
+        return iter(self.__references.get(url, ()))
+
+    @property
+    def errors (self):
+        return self.__errors
+
+    @property
+    def warnings (self):
+        return self.__warnings
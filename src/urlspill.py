@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import os, pickle, sqlite3
+
+
+class URLSpill (object):
+
+    """
+        Queues of items per host kept in a sqlite file, as pickled chunks numbered in queue order
+        Items can be written at both ends of a queue and are read back from its front a chunk at a time
+    """
+
+    def __init__ (self, fname, chunk = 1000):
+
+        directory = os.path.dirname(fname)
+
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+        # the file only outlives the queue on a crash, nothing to keep safe
+        self.__db = sqlite3.connect(fname, timeout = 30.0, isolation_level = None, check_same_thread = False)
+        self.__db.execute('PRAGMA journal_mode = OFF')
+        self.__db.execute('PRAGMA synchronous = OFF')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS chunks (address TEXT, seq INTEGER, data BLOB, PRIMARY KEY (address, seq)) WITHOUT ROWID')
+        self.__db.execute('DELETE FROM chunks')
+
+        self.__chunk = max(1, chunk)
+
+        # address -> [ first seq, next seq, items ]
+        self.__queues = {}
+        self.__size = 0
+
+    def ___write (self, address, seq, items):
+        self.__db.execute('INSERT INTO chunks (address, seq, data) VALUES (?, ?, ?)', ( address, seq, pickle.dumps(items, pickle.HIGHEST_PROTOCOL) ))
+
+    def append (self, address, items):
+
+        queue = self.__queues.setdefault(address, [ 0, 0, 0 ])
+
+        for start in range(0, len(items), self.__chunk):
+            self.___write(address, queue[1], items[ start : start + self.__chunk ])
+            queue[1] += 1
+
+        queue[2] += len(items)
+        self.__size += len(items)
+
+    def prepend (self, address, items):
+
+        queue = self.__queues.setdefault(address, [ 0, 0, 0 ])
+
+        for start in reversed(range(0, len(items), self.__chunk)):
+            queue[0] -= 1
+            self.___write(address, queue[0], items[ start : start + self.__chunk ])
+
+        queue[2] += len(items)
+        self.__size += len(items)
+
+    def take (self, address):
+
+        """ Removes and returns the first chunk of items of address, an empty list if none """
+
+        queue = self.__queues.get(address)
+
+        if queue is None:
+            return []
+
+        row = self.__db.execute('SELECT data FROM chunks WHERE address = ? AND seq = ?', ( address, queue[0] )).fetchone()
+        self.__db.execute('DELETE FROM chunks WHERE address = ? AND seq = ?', ( address, queue[0] ))
+
+        items = pickle.loads(row[0])
+
+        queue[0] += 1
+        queue[2] -= len(items)
+        self.__size -= len(items)
+
+        if queue[0] == queue[1]:
+            del self.__queues[address]
+
+        return items
+
+    def peek (self, address):
+        for data, in self.__db.execute('SELECT data FROM chunks WHERE address = ? ORDER BY seq', ( address, )).fetchall():
+            yield from pickle.loads(data)
+
+    def drop (self, address):
+
+        queue = self.__queues.pop(address, None)
+
+        if queue is not None:
+            self.__db.execute('DELETE FROM chunks WHERE address = ?', ( address, ))
+            self.__size -= queue[2]
+
+    def count (self, address):
+        queue = self.__queues.get(address)
+        return 0 if queue is None else queue[2]
+
+    @property
+    def size (self):
+        return self.__size
+
+    def close (self):
+        self.__db.close()
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
-import os, re, sys, socket, unicodedata, collections
+import os, re, sys, zlib, codecs, socket, unicodedata, collections
 import http.client
-import urllib.robotparser
 import itertools as it
 
 
@@ -16,15 +15,25 @@ class URLException (Exception):
     def __repr__ (self):
         return str(self)
 
-def fetch_robots (url):
-    robots = urllib.robotparser.RobotFileParser(url.hyperlink('/robots.txt').encoded)
+def fetch_robots (url, pool, max_redirects = 5, **kwargs):
 
-    try:
-        robots.read()
-    except ( urllib.error.URLError, ConnectionError ):
-        robots = None
+    """ Fetches the robots.txt of the host of url through pool, returns ( status, text ) or None if not available """
+
+    robots_url = url.hyperlink('/robots.txt')
+
+    for _ in range(max_redirects + 1):
+        rep, data = make_request(robots_url, 'GET', robots_url.request_encoded, pool = pool, **kwargs)
+
+        if rep is None or rep.status >= 500:
+            return None
 
-    return robots
+        if rep.status >= 300 and rep.status < 400 and rep.getheader('location'):
+            robots_url = robots_url.hyperlink(rep.getheader('location'))
+            continue
+
+        return rep.status, data.decode('utf-8', errors = 'ignore') if rep.status < 300 else ''
+
+    return None
 
 def parse_headers (headers):
     result = {}
@@ -35,12 +44,32 @@ def parse_headers (headers):
 
     return result
 
-def make_request (conn, method, url, max_attempts = 0, attempt = 0, **kwargs):
+def make_request (conn, method, url, max_attempts = 0, attempt = 0, pool = None, read_body = True, drain_limit = 65536, **kwargs):
+
+    """
+        Requests url on conn and reads the response, returns ( response, data ) or ( None, error message )
+        When a pool is given conn is an URLHttp on the host to request, a pooled connection is used and released
+        read_body may be a function deciding from the response headers if the body is needed, an unneeded
+        body up to drain_limit bytes is discarded to keep the connection alive, otherwise the connection is closed
+        With read_body None the body is left unread, it must be read or discarded before conn is used again
+    """
+
+    if pool is not None:
+        target = conn
+        conn = pool.acquire(target)
+
+        if conn is None:
+            return ( None, 'Could not connect to http server' )
+
+        rep, data = make_request(conn, method, url, max_attempts, attempt, read_body = read_body, drain_limit = drain_limit, **kwargs)
+        pool.release(conn, reuse = rep is not None and not rep.will_close and conn.sock is not None)
+
+        return rep, data
 
     try:
         conn.request(method, url, **kwargs)
         rep = conn.getresponse()
-    except ( socket.error, ConnectionError, ValueError, http.client.BadStatusLine ) as exc:
+    except ( socket.error, ConnectionError, ValueError, http.client.HTTPException ) as exc:
 
         if sys.version_info < ( 3, 5 ) or not isinstance(exc, ConnectionError):
             conn.close()
@@ -53,16 +82,174 @@ def make_request (conn, method, url, max_attempts = 0, attempt = 0, **kwargs):
         if attempt >= max_attempts:
             return ( None, str(exc) )
 
-        return make_request(conn, method, url, max_attempts, attempt + 1, **kwargs)
+        return make_request(conn, method, url, max_attempts, attempt + 1, read_body = read_body, drain_limit = drain_limit, **kwargs)
+
+    if read_body is None:
+        return rep, None
+
+    if callable(read_body):
+        read_body = read_body(rep)
+
+    if not read_body:
+        discard_body(conn, rep, drain_limit)
+        return rep, b''
 
     return rep, rep.read()
 
+def read_chunk (rep, chunk_size = 65536):
+
+    """ Reads the next available piece of a response body, b'' at its end """
+
+    try:
+        chunk = rep.read1(chunk_size)
+    except ( socket.error, http.client.HTTPException ) as exc:
+        raise URLException('Could not fetch data from server: {0}'.format(exc))
+
+    # read1 leaves a response with a length open after its last byte, the connection could not be used again
+    if not chunk:
+        rep.close()
+
+    return chunk
+
+def read_chunks (rep, chunk_size = 65536):
+    while True:
+        chunk = read_chunk(rep, chunk_size)
+
+        if not chunk:
+            break
+
+        yield chunk
+
+def discard_body (conn, rep, drain_limit = None):
+
+    """ Reads and drops a response body to keep conn alive, closes conn instead if the body may be longer than drain_limit """
+
+    if rep.isclosed():
+        return
+
+    if drain_limit is not None and ( rep.length is None or rep.length > drain_limit ):
+        rep.close()
+        conn.close()
+    else:
+        for _ in read_chunks(rep):
+            pass
+
+class Inflate (object):
+
+    """ Deflate decompressor of a single response, servers send both zlib wrapped and raw deflate streams """
+
+    def __init__ (self):
+        self.__decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        self.__started = False
+
+    def decompress (self, data, max_length = 0):
+
+        if not self.__started and data:
+            self.__started = True
+
+            try:
+                return self.__decompressor.decompress(data, max_length)
+            except zlib.error:
+                self.__decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+        return self.__decompressor.decompress(data, max_length)
+
+    def flush (self):
+        return self.__decompressor.flush()
+
+def decompressor (encoding):
+
+    """ Returns a new decompressor for a Content-Encoding, None for identity """
+
+    encoding = encoding.strip().lower()
+
+    if encoding == 'gzip' or encoding == 'x-gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    if encoding == 'deflate':
+        return Inflate()
+
+    if encoding == '' or encoding == 'identity':
+        return None
+
+    # TODO accept brotli compression
+    raise URLException('Unsupported content encoding: {0}'.format(encoding))
+
 def content_split (content):
     return dict(
         it.islice(it.chain(val.strip().lower().split('=', 1), it.repeat('')), 0, 2)
         for val in filter(bool, content.split(';'))
     )
 
+def content_kind (content_type):
+
+    """ Returns 'html', 'css' or 'js' for a content_split result of the mime types the crawler reads, None for any other """
+
+    for kind, types in content_kind.types.items():
+        for name in types:
+            if name in content_type:
+                return kind
+
+    return None
+
+content_kind.types = {
+    'html': ( 'text/html', 'application/xhtml+xml' ),
+    'css': ( 'text/css', ),
+    'js': (
+        'application/javascript',
+        'application/x-javascript',
+        'text/javascript',
+        'application/ecmascript',
+        'application/x-ecmascript'
+    )
+}
+
+def sniff_charset (data, content_type = None, kind = 'html'):
+
+    """
+        Charset of a body from its first bytes, before decoding it, None if nothing declares one
+        Its byte order mark comes first, then the charset of its content_split content type,
+        then a meta declaration in the first window bytes of an html body or the @charset rule of a css one
+    """
+
+    for bom, charset in sniff_charset.boms:
+        if data.startswith(bom):
+            return charset
+
+    if content_type is not None and content_type.get('charset'):
+        return content_type['charset']
+
+    if kind == 'html':
+        head = sniff_charset.comment.sub(b'', data[ : sniff_charset.window ])
+        match = sniff_charset.meta.search(head)
+    elif kind == 'css':
+        match = sniff_charset.css.match(data)
+    else:
+        match = None
+
+    if match is None:
+        return None
+
+    charset = match.group(1).decode('ascii').lower()
+
+    try:
+        name = codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+    # a document read as utf-16 could not have declared it in ascii
+    return 'utf-8' if name.startswith('utf-16') else charset
+
+sniff_charset.window = 4096
+sniff_charset.boms = (
+    ( codecs.BOM_UTF8, 'utf-8-sig' ),
+    ( codecs.BOM_UTF16_LE, 'utf-16' ),
+    ( codecs.BOM_UTF16_BE, 'utf-16' )
+)
+sniff_charset.comment = re.compile(rb'<!--.*?(?:-->|$)', re.S)
+sniff_charset.meta = re.compile(rb'<meta[\s/][^>]*?charset\s*=\s*["\']?\s*([-\w.:]+)', re.I)
+sniff_charset.css = re.compile(rb'@charset "([-\w.:]+)";')
+
 def make_gnu_error (message):
 
     text = ''
@@ -104,6 +291,166 @@ normalize_filename.non_word = re.compile(r'[^\w_.,-]')
 def normalize_filepath (name):
     return os.path.normpath('/'.join(normalize_filename(p) for p in name.split('/')))
 
+class RuleSet (object):
+
+    """
+        Regex rules merged for matching, search(text) tells if any of them matches text
+        Rules starting with ^SCHEME:// and a literal are indexed by that literal, so only rules that may match are run,
+        the rules of each literal and the other rules are merged in few alternations and decisions are memoized
+    """
+
+    @staticmethod
+    def ___alternated (rule):
+
+        """ Tells if rule has an alternation outside any group """
+
+        depth = 0
+        in_class = False
+        index = 0
+
+        while index < len(rule):
+            char = rule[index]
+
+            if char == '\\':
+                index += 2
+                continue
+
+            if in_class:
+                in_class = char != ']'
+            elif char == '[':
+                in_class = True
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char == '|' and depth == 0:
+                return True
+
+            index += 1
+
+        return False
+
+    @staticmethod
+    def literal (rule):
+
+        """ Literal text following SCHEME:// that every match of an anchored rule has, '' if there is none """
+
+        head = RuleSet.literal.head.match(rule)
+
+        if head is None or RuleSet.___alternated(rule):
+            return ''
+
+        chars = []
+        index = head.end()
+
+        while True:
+            token = RuleSet.literal.token.match(rule, index)
+
+            if token is None:
+                break
+
+            index = token.end()
+
+            if rule[ index : index + 1 ] in ( '?', '*', '+', '{' ):
+                break
+
+            chars.append(token.group(1) or token.group(2))
+
+        return ''.join(chars)
+
+    @staticmethod
+    def merge (rules):
+
+        """ Compiles rules in alternations of up to merge.size rules, rules with flags, backreferences or named groups stay alone """
+
+        patterns = []
+        mergeable = []
+
+        for rule in rules:
+            if RuleSet.merge.unmergeable.search(rule):
+                patterns.append(re.compile(rule))
+            else:
+                re.compile(rule)
+                mergeable.append(rule)
+
+        for start in range(0, len(mergeable), RuleSet.merge.size):
+            patterns.append(re.compile('|'.join('(?:{0})'.format(rule) for rule in mergeable[ start : start + RuleSet.merge.size ])))
+
+        return patterns
+
+    def __init__ (self, rules = ()):
+        self.__rules = collections.OrderedDict()
+        self.update(rules)
+
+    def ___build (self):
+
+        indexed = {}
+        others = []
+
+        for rule in self.__rules:
+            literal = RuleSet.literal(rule)
+
+            if literal:
+                indexed.setdefault(literal, []).append(rule)
+            else:
+                others.append(rule)
+
+        self.__indexed = { literal: RuleSet.merge(rules) for literal, rules in indexed.items() }
+        self.__lengths = sorted(set(map(len, indexed)))
+        self.__others = RuleSet.merge(others)
+        self.__memo = {}
+
+    def update (self, rules):
+
+        """ Adds regex rules, given as strings, compiled patterns or another RuleSet """
+
+        for rule in rules:
+            self.__rules[getattr(rule, 'pattern', rule)] = None
+
+        self.___build()
+
+    def ___search (self, text):
+
+        rest = text.partition('://')[2]
+
+        for length in self.__lengths:
+
+            if length > len(rest):
+                break
+
+            for pattern in self.__indexed.get(rest[ : length ], ()):
+                if pattern.search(text):
+                    return True
+
+        return any(pattern.search(text) for pattern in self.__others)
+
+    def search (self, text):
+
+        memo = self.__memo
+        result = memo.get(text)
+
+        if result is None:
+            result = self.___search(text)
+
+            if len(memo) >= RuleSet.memo_size:
+                memo.clear()
+
+            memo[text] = result
+
+        return result
+
+    def __iter__ (self):
+        return iter(self.__rules)
+
+    def __len__ (self):
+        return len(self.__rules)
+
+RuleSet.literal.head = re.compile(r'\^[a-z0-9?|()+]*://')
+RuleSet.literal.token = re.compile(r'\\([^0-9A-Za-z])|([0-9A-Za-z_:@%~,;=!&/-])')
+RuleSet.merge.size = 500
+RuleSet.merge.unmergeable = re.compile(r'\(\?[aiLmsux]|\(\?P[<=]|\\[1-9]')
+RuleSet.memo_size = 65536
+
 class RuleDict (dict):
     def __missing__ (self, key):
         return '[*' + key + '*]'
@@ -124,7 +471,7 @@ def compile_rules (rules, urls):
             if resulting_rule == rule:
                 break
 
-    return collections.OrderedDict.fromkeys(map(re.compile, result.keys()))
+    return RuleSet(result.keys())
 
 compile_rules.format = re.compile(r'\[\*([a-z_]+)\*\]')
 compile_rules.escape = re.compile(r'([{}])')
@@ -1,12 +1,10 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os, sys, zlib, gzip, re, socket, uuid, time, signal, argparse, textwrap
-import http.client
-import urllib.parse, urllib.request, urllib.error, urllib.robotparser
+import os, time, signal, argparse, textwrap
 
 import multiprocessing as mp, multiprocessing.managers
 
-import urlutils, urlhttp, urldeque, urlfinder, urlcookie, urlvalidator
+import urlutils, urlhttp, urldeque, urlcookie, urlvalidator, urlcrawler, urlasync, urlshard, urlfrontier, urlcheckpoint, urlgraph, urlseen, urlspill, urlpolicy
 
 from color import Color
 
@@ -25,12 +23,60 @@ if __name__ == '__main__':
     parser.add_argument('--version', action = 'version', version = '%(prog)s {0}'.format(PROG_VERSION), help = 'print %(prog)s version')
     parser.add_argument('-color', action = 'store_true', help = 'enable terminal colors')
 
+    group = parser.add_argument_group('Engine options')
+    group.add_argument('-engine', choices = ( 'sync', 'async' ), default = 'sync', help = 'sync fetches one url at a time from a single connection\nasync keeps many requests in flight across hosts')
+    group.add_argument('-concurrency', metavar = 'N', default = 16, type = int, help = 'maximum requests in flight (async engine)')
+    group.add_argument('-workers', metavar = 'N', default = 1, type = int, help = 'crawl with N processes, hosts are sharded among them')
+    group.add_argument('-max-connections', metavar = 'N', default = 4, type = int, help = 'maximum keep-alive connections per host')
+    group.add_argument('-frontier-policy',
+        choices = ( 'fifo', ) + tuple(urlpolicy.URLPolicy.policies), default = 'fifo',
+        help = textwrap.dedent("""\
+            order to crawl the queued urls in, but for fifo
+            the host with the first url is crawled next
+            fifo: assets depth first, pages breadth first
+            bfs: urls closer to the starting urls first
+            assets: assets first, seeds: starting urls first
+            fewest-refs / most-refs: least / most linked first
+        """)
+    )
+    group.add_argument('-idle-timeout', metavar = 'SEC', default = 30.0, type = float, help = 'close pooled connections idle for longer than SEC')
+
+    group = parser.add_argument_group('Checkpoint options')
+    group.add_argument('-checkpoint-dir', metavar = 'DIR', help = 'log crawled urls to DIR so the crawl can be resumed')
+    group.add_argument('-checkpoint-interval', metavar = 'SEC', default = 30.0, type = float, help = 'write the checkpoint log every SEC seconds')
+    group.add_argument('-resume', metavar = 'DIR', help = 'resume the crawl logged to DIR, keeps logging to it\nuse the same urls and options of the interrupted crawl')
+
+    group = parser.add_argument_group('Large crawl options')
+    group.add_argument('-graph', metavar = 'FILE', help = 'keep which pages reference each url in FILE instead of memory\nworkers keep theirs in FILE.N')
+    group.add_argument('-graph-export', metavar = 'FILE', help = 'write every reference found to FILE as tab separated\npage, url and redirects followed lines')
+    group.add_argument('-seen-error', metavar = 'RATE', type = float, help = 'tell new urls with a Bloom filter of false positive RATE\nonly queued urls are kept in memory, needs -graph')
+    group.add_argument('-seen-capacity', metavar = 'N', default = 1 << 20, type = int, help = 'urls held by the first Bloom filter, grows as needed')
+    group.add_argument('-spill', metavar = 'FILE', help = 'move queued urls beyond -spill-window to FILE\nworkers keep theirs in FILE.N')
+    group.add_argument('-spill-window', metavar = 'N', default = 100000, type = int, help = 'queued urls kept in memory before spilling')
+
+    group = parser.add_argument_group('Distributed crawl options',
+        description = textwrap.dedent("""\
+            The frontier and every crawler must be started with the same urls and rules
+            ADDRESS is HOST:PORT or the path of an Unix socket
+        """)
+    )
+    group.add_argument('-frontier-serve', metavar = 'ADDRESS', type = urlfrontier.parse_address, help = 'own the crawl frontier and lease it to crawlers, fetches nothing')
+    group.add_argument('-frontier-connect', metavar = 'ADDRESS', type = urlfrontier.parse_address, help = 'crawl leases of the frontier served at ADDRESS')
+    group.add_argument('-frontier-key', metavar = 'KEY', help = 'shared secret authenticating crawlers to the frontier')
+    group.add_argument('-lease-size', metavar = 'N', default = 100, type = int, help = 'maximum urls of a host leased at once')
+    group.add_argument('-lease-timeout', metavar = 'SEC', default = 300.0, type = float, help = 'queue leased urls again if not completed in SEC')
+
     group = parser.add_argument_group('Disable options')
     group.add_argument('-no-robots', action = 'store_true', help = 'ignore websites robots.txt rules (NOT RECOMMENDED)')
     group.add_argument('-no-redirect', action = 'store_true', help = 'ignore website redirection')
     group.add_argument('-no-cookies', action = 'store_true', help = 'ignore website cookies')
     group.add_argument('-no-css', action = 'store_true', help = 'do not extract links from CSS files')
 
+    group = parser.add_argument_group('Robots options')
+    group.add_argument('-robots-cache', metavar = 'FILE', help = 'keep fetched robots.txt in FILE across runs')
+    group.add_argument('-robots-ttl', metavar = 'SEC', default = 86400.0, type = float, help = 'fetch robots.txt again after SEC')
+    group.add_argument('-max-crawl-delay', metavar = 'SEC', default = 10.0, type = float, help = 'highest robots.txt Crawl-delay honored (0 to ignore it)')
+
     group = parser.add_argument_group('Validation options')
     group.add_argument('-valid-html', action = 'store_true', help = 'validate HTML online using W3C validator\navailable at https://validator.nu/')
     group.add_argument('-valid-css', action = 'store_true', help = 'validate CSS online using W3C validator\navailable at https://jigsaw.w3.org/css-validator/')
@@ -62,6 +108,11 @@ if __name__ == '__main__':
             [ ; HttpOnly ] [ ; Secure ] [ ; ... ]"
         """)
     )
+    group.add_argument('-header-first', action = 'store_true', help = 'read response headers first and skip bodies that will not be parsed')
+    group.add_argument('-probe-assets', choices = ( 'head', 'range' ), help = 'check urls of images, media, archives, ... with a HEAD\nor a "Range: bytes=0-0" request instead of downloading them')
+    group.add_argument('-max-body-size', metavar = 'BYTES', default = 64 << 20, type = int, help = 'stop reading decompressed bodies larger than BYTES (0 for no limit)')
+    group.add_argument('-max-ratio', metavar = 'N', default = 200.0, type = float, help = 'stop reading bodies decompressing to more than N times their size (0 for no limit)')
+    group.add_argument('-cache', metavar = 'FILE', help = 'cache validators and links of crawled urls in FILE\nunchanged urls are revalidated instead of downloaded')
     group.add_argument('--headers', nargs = '+', default = [], metavar = 'HEADER', help = 'headers to send, syntax:\n"NAME=VAL"')
 
     group = parser.add_argument_group('Link matching rules',
@@ -105,15 +156,46 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
+    if ( args.frontier_serve or args.frontier_connect ) and not args.frontier_key:
+        parser.error('-frontier-key is required to serve or connect to a frontier')
+
+    args.checkpoint_dir = args.resume or args.checkpoint_dir
+
+    if args.checkpoint_dir and ( args.workers > 1 or args.frontier_serve or args.frontier_connect ):
+        parser.error('checkpoints are only supported by single process crawls')
+
+    if args.seen_error is not None and not ( args.graph and 0 < args.seen_error < 1 ):
+        parser.error('-seen-error needs -graph and a RATE between 0 and 1')
+
+    if args.frontier_policy != 'fifo' and ( args.spill or args.seen_error is not None ):
+        parser.error('-frontier-policy keeps every queued url in memory, it cannot be used with -spill or -seen-error')
+
+    args.policy = urlpolicy.URLPolicy.policies[args.frontier_policy]() if args.frontier_policy != 'fifo' else None
+
+    if args.graph_export and ( args.workers > 1 or args.frontier_serve or args.frontier_connect ):
+        parser.error('graph exports are only supported by single process crawls')
+
     Color.enabled = args.color
 
     start_cookies = urlcookie.CookieJar()
     fixed_cookies = urlcookie.CookieJar()
 
-    errors = {}
-    warnings = {}
+    graph = None
+    seen = None
+    spill = None
+
+    # shard workers and the frontier keep stores of their own
+    if args.workers <= 1 and not ( args.frontier_serve or args.frontier_connect ):
+        if args.graph:
+            graph = urlgraph.URLGraph(args.graph)
 
-    urls = urldeque.URLDeque()
+            if args.seen_error is not None:
+                seen = urlseen.URLSeen(args.seen_capacity, args.seen_error)
+
+        if args.spill:
+            spill = urlspill.URLSpill(args.spill)
+
+    urls = urldeque.URLDeque(graph, seen, spill, args.spill_window, args.policy)
 
     args.headers = { name.title() : value for name, value in ( header.split('=', 1) for header in args.headers ) }
     args.headers['User-Agent'] = args.user_agent
@@ -176,190 +258,30 @@ if __name__ == '__main__':
         js_process = mp.Process(target = urlvalidator.URLValidator.thread_js, args = ( js_queue, js_result ))
         js_process.start()
 
-    decompress = {
-        'gzip': gzip,
-        'x-gzip': gzip,
-        'deflate': zlib.decompressobj(wbits = zlib.MAX_WBITS)
-    }
-
-    try:
-        while not urls.empty:
-
-            url = urlhttp.URLHttp(urls.pop_domain())
+    checkpoint = None
 
-            robots = None
+    if args.checkpoint_dir:
+        checkpoint = urlcheckpoint.URLCheckpoint(args.checkpoint_dir, args.checkpoint_interval)
 
-            if not args.no_robots:
-                robots = urlutils.fetch_robots(url)
+    if args.frontier_serve:
+        crawler = urlfrontier.URLFrontierServer(args, urls, args.frontier_serve, args.frontier_key.encode('utf-8'), args.lease_size, args.lease_timeout)
+    elif args.frontier_connect:
+        crawler = urlfrontier.URLFrontierWorker(args, fixed_cookies, args.frontier_connect, args.frontier_key.encode('utf-8'), html_queue, css_queue, js_queue)
+    elif args.workers > 1:
+        crawler = urlshard.URLShards(args, urls, fixed_cookies, html_queue, css_queue, js_queue, workers = args.workers)
+    elif args.engine == 'async':
+        crawler = urlasync.URLAsyncCrawler(args, urls, fixed_cookies, html_queue, css_queue, js_queue, checkpoint = checkpoint, concurrency = args.concurrency)
+    else:
+        crawler = urlcrawler.URLCrawler(args, urls, fixed_cookies, html_queue, css_queue, js_queue, checkpoint = checkpoint)
 
-                if robots is None:
-                    print(Color.RED % 'Could not fetch robots.txt at {0}'.format(url))
+    errors = crawler.errors
+    warnings = crawler.warnings
 
-            #TODO support proxies
-            if url.ssl:
-                conn = http.client.HTTPSConnection(url.netloc_encoded, timeout = args.timeout)
-            else:
-                conn = http.client.HTTPConnection(url.netloc_encoded, timeout = args.timeout)
+    if args.resume:
+        print(Color.CYAN % 'Resumed {0} crawled urls from {1}'.format(checkpoint.restore(urls, errors, warnings), args.resume))
 
-            try:
-                conn.connect()
-            except ( socket.error, ConnectionError ):
-                while not urls.empty_domain:
-                    url, *ignore = urls.pop_url()
-                    errors.setdefault(url, []).append('Could not connect to http server')
-                continue
-
-            while not urls.empty_domain:
-
-                try:
-                    url, ref, cookies, charset = urls.pop_url()
-
-                    if robots is not None and not robots.can_fetch(args.user_agent, url.encoded):
-                        print(Color.YELLOW % 'Robot not allowed at {0}'.format(url.full))
-
-                    else:
-                        cookies.clear_expired()
-                        fixed_cookies.clear_expired()
-                        url_cookies = fixed_cookies | cookies
-
-                        request_headers = args.headers.copy()
-
-                        if url_cookies:
-                            cookie_txt = '; '.join(map(str, url_cookies.match(url.scheme, url.hostname_encoded, url.path_encoded)))
-                            if request_headers.get('Cookie', ''):
-                                cookie_txt = request_headers['Cookie'] + '; ' + cookie_txt
-                            request_headers['Cookie'] = cookie_txt
-
-                        if ref != url and not 'Referer' in request_headers:
-                            request_headers['Referer'] = ref.encoded
-
-                        request = url.request_encoded
-
-                        rep, response_data = urlutils.make_request(conn, 'GET', url.request_encoded, headers = request_headers)
-
-                        if rep is None or rep.status >= 400:
-                            new_rep, new_response_data = urlutils.make_request(conn, 'GET', url.request, headers = request_headers)
-
-                            if new_rep is not None and new_rep.status < 400:
-                                request = url.request
-                                rep = new_rep
-                                response_data = new_response_data
-
-                        if rep is None:
-                            raise urlutils.URLException('Could not fetch data from server: {0}'.format(response_data))
-
-                        response_headers = urlutils.parse_headers(rep.getheaders())
-
-                        if not args.no_cookies and 'set-cookie' in response_headers:
-                            cookies = cookies.copy()
-                            cookies.set(url.encoded, *response_headers['set-cookie'])
-
-                        redirect = None
-
-                        if not args.no_redirect and 'location' in response_headers:
-                            redirect = url.hyperlink(response_headers['location'][0])
-                        else:
-                            print((Color.GREEN if rep.status < 300 else Color.YELLOW) % '{0} {1} {2}'.format(url, rep.status, rep.reason))
-
-                            if rep.status >= 300:
-                                if rep.status >= 400:
-                                    warnings.setdefault(url, []).append('{0} {1}'.format(rep.status, rep.reason))
-                                else:
-                                    warnings.setdefault(url, []).append('{0} {1} (no redirect location given)'.format(rep.status, rep.reason))
-
-                            include = False
-
-                            for rule in args.include_rules:
-                                if rule.search(url.full):
-                                    include = True
-                                    break
-
-                            if include:
-                                for rule in args.exclude_rules:
-                                    if rule.search(url.full):
-                                        include = False
-                                        break
-
-                            if not include:
-                                continue
-
-                            content_type = urlutils.content_split(response_headers.get('content-type', [ 'application/octet-stream; charset=iso-8859-1' ])[0])
-
-                            is_html = 'text/html' in content_type or 'application/xhtml+xml' in content_type
-                            is_css = 'text/css' in content_type
-                            is_js = (
-                                'application/javascript' in content_type or
-                                'application/x-javascript' in content_type or
-                                'text/javascript' in content_type or
-                                'application/ecmascript' in content_type or
-                                'application/x-ecmascript' in content_type
-                            )
-
-                            if is_html or ( is_css and ( not args.no_css or args.valid_css ) ) or ( is_js and args.valid_js ):
-
-                                # TODO accept brotli compression
-                                if 'content-encoding' in response_headers:
-                                    method = response_headers['content-encoding'][0]
-                                    response_data = decompress[method].decompress(response_data)
-
-                                if 'charset' in content_type:
-                                    data = response_data.decode(content_type['charset'], errors = 'ignore')
-                                    charset = content_type['charset']
-                                else:
-                                    try:
-                                        data = response_data.decode(charset, errors = 'strict')
-                                    except ValueError:
-                                        data = response_data.decode('iso-8859-1', errors = 'ignore')
-                                        charset = 'iso-8859-1'
-
-                                if is_html:
-                                    html = urlfinder.URLFinderHTML(data, url, charset)
-                                    charset = html.charset
-
-                                    if args.valid_html:
-                                        html_queue.put(( url, gzip.compress(response_data), {
-                                            'Content-Type': response_headers['content-type'][0],
-                                            'Content-Encoding': 'gzip'
-                                        } ))
-
-                                    for link, element, attr in html.urls:
-                                        if http != 'href' or element['attrs'].get('rel') != 'nofollow':
-                                            if not args.no_redirect and element['tag'] == 'meta' and element['attrs'].get('http-equiv', '').lower() == 'refresh' and attr == 'content':
-                                                redirect = link
-                                            else:
-                                                urls.push(link, url, cookies, charset, front = ( element['tag'] != 'a' or attr != 'href' ))
-
-                                elif is_css:
-
-                                    if not args.no_css:
-                                        css = urlfinder.URLFinderCSS(data, url, charset)
-                                        charset = css.charset
-
-                                        for link in css:
-                                            urls.push(link, url, cookies, charset, front = True)
-
-                                    if args.valid_css:
-                                        css_queue.put(url)
-
-                                elif is_js:
-                                    #TODO parse javascript
-                                    if args.valid_js:
-                                        js_queue.put(( url, data ))
-
-                        if redirect is not None:
-                            try:
-                                urls.push_redirect(redirect, url, cookies, charset, front = True)
-                            except urldeque.InfiniteRedirection as infinite_redir:
-                                print(Color.RED % 'Redirection loop detected!')
-                                print(Color.RED % '{0} --> ... --> {1} --> ... --> {0}'.format(url, redirect, url))
-                                raise urlutils.URLException(str(infinite_redir))
-                            else:
-                                print(Color.CYAN % '{0} --> {1}'.format(url, redirect))
-
-                except urlutils.URLException as exc:
-                    errors.setdefault(url, []).append(exc.value)
-
-            conn.close()
+    try:
+        crawler.crawl()
 
     except KeyboardInterrupt:
         pass
@@ -479,7 +401,7 @@ if __name__ == '__main__':
                 print(Color.RED % 'Error: {0}'.format(error))
 
             print('Referenced by:')
-            for page in urls.references(url):
+            for page in crawler.references(url):
                 print('-> {0}'.format(page))
 
     if args.valid_html:
@@ -490,3 +412,9 @@ if __name__ == '__main__':
 
     if args.valid_js:
         print('\nJavaScript validation issues saved to {0}'.format(js_fname))
+
+    if args.graph_export:
+        urls.export(args.graph_export)
+        print('\nReference graph saved to {0}'.format(args.graph_export))
+
+    urls.close()
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import collections, copy, threading, itertools, re, urllib.parse
+import sys, collections, copy, threading, itertools, re, urllib.parse
 
 
 class NotEmpty (Exception):
@@ -182,6 +182,14 @@ class xArray (object):
         xarray.___set_state(copy.deepcopy(self.__data, memo), copy.deepcopy(self.__local_registered_types, memo), self.__next)
         return xarray
 
+    def __getstate__ (self):
+        return ( self.__sync, self.__str2int, self.__float2int ) + self.___get_state()
+
+    def __setstate__ (self, state):
+        self.__data_lock = threading.RLock()
+        self.___set_flags(*state[ : 3 ])
+        self.___set_state(*state[ 3 : ])
+
     def __copy__ (self):
         xarray = xArray(is_sync = self.__sync, convert_str = self.__str2int, convert_float = self.__float2int)
         xarray.___set_state(copy.copy(self.__data), copy.deepcopy(self.__local_registered_types), self.__next)
@@ -195,6 +203,8 @@ class xArray (object):
         return len(self.__data)
 
     def __eq__ (self, other):
+        if type(other) is FrozenXArray:
+            return other == self
         if type(other) is xArray and len(self) == len(other):
             for key, val in self.items():
                 try:
@@ -257,6 +267,141 @@ xArray.default_registered_types = {
     xArray : xArray.pack_recursive
 }
 
+class FrozenXArray (object):
+
+    """
+        Immutable and hashable xArray, as parsed from a query string
+        Keys are stored converted like from_query does, the query encoding and the hash are computed once
+    """
+
+    __slots__ = ( '__items', '__query', '__hash' )
+
+    @staticmethod
+    def index (key):
+        if type(key) is str:
+            try:
+                return int(key)
+            except ValueError:
+                pass
+        return key
+
+    def __init__ (self, items = (), query = None):
+        self.___set_state(tuple(items), query)
+
+    def ___set_state (self, items, query):
+
+        self.__items = items
+        self.__query = xArray._xArray___to_query(dict(items)) if query is None else query
+        self.__hash = hash(self.key)
+
+    def items (self):
+        return iter(self.__items)
+
+    @property
+    def keys (self):
+        return set(self)
+
+    @property
+    def query (self):
+        return self.__query
+
+    @property
+    def key (self):
+
+        """ Contents regardless of their order, keys are unique so equal xArrays have equal keys """
+
+        return frozenset(self.__items)
+
+    def __getstate__ (self):
+        return ( self.__items, self.__query )
+
+    def __setstate__ (self, state):
+        self.___set_state(*state)
+
+    def __copy__ (self):
+        return self
+
+    def __deepcopy__ (self, memo):
+        return self
+
+    def __iter__ (self):
+        for key, _ in self.__items:
+            yield key
+
+    def __len__ (self):
+        return len(self.__items)
+
+    def __eq__ (self, other):
+
+        if isinstance(other, FrozenXArray):
+            return self.__hash == other.__hash and ( self.__items == other.__items or self.key == other.key )
+
+        if isinstance(other, xArray) and len(self) == len(other):
+            for key, val in self.__items:
+                if key not in other or not val == other[key]:
+                    return False
+            return True
+
+        return False
+
+    def __getitem__ (self, key):
+
+        index = FrozenXArray.index(key)
+
+        for item_key, val in self.__items:
+            if item_key == index:
+                return val
+
+        raise KeyError(key)
+
+    def __contains__ (self, key):
+        index = FrozenXArray.index(key)
+        return any(item_key == index for item_key, _ in self.__items)
+
+    def __str__ (self):
+        return '{ ' + ', '.join('{0}: {1}'.format(repr(key), repr(val)) for key, val in self.__items) + ' }'
+
+    def __repr__ (self):
+        return str(self)
+
+    def __hash__ (self):
+        return self.__hash
+
+FrozenXArray.empty = FrozenXArray()
+
+def freeze (data):
+
+    """ FrozenXArray with the contents of an xArray """
+
+    return FrozenXArray(( ( key, freeze(val) if isinstance(val, xArray) else val ) for key, val in data.items() ), data.query)
+
+def frozen_query (query):
+
+    """ Parses a query string like from_query into a FrozenXArray, queries without arrays skip building an xArray """
+
+    if not query:
+        return FrozenXArray.empty
+
+    items = {}
+
+    for value in from_query.query_split_keys.split(query):
+
+        if value:
+            arg, val = (value + '=').split('=', 1)
+            arg = urllib.parse.unquote_plus(arg)
+
+            if from_query.query_match_arrays.search(arg) is not None:
+                return freeze(from_query(query))
+
+            items[FrozenXArray.index(sys.intern(arg))] = urllib.parse.unquote_plus(val)[ : -1 ]
+
+    if not items:
+        return FrozenXArray.empty
+
+    encoded = '&'.join(urllib.parse.quote_plus(str(key)) + '=' + urllib.parse.quote_plus(val) for key, val in items.items())
+
+    return FrozenXArray(items.items(), query if encoded == query else encoded)
+
 def from_query (query):
     result = xArray(convert_str = True)
     for value in from_query.query_split_keys.split(query):